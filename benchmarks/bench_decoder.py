@@ -0,0 +1,101 @@
+# -*- coding:utf-8 -*-
+"""
+Trains detokenization models on a synthetic corpus and compares the
+search configurations of the decoder on it: number of expanded
+hypotheses, decoding time and best scores.
+
+Usage: PYTHONPATH=. python benchmarks/bench_decoder.py
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import random
+import shutil
+import tempfile
+import timeit
+
+from thot_utils.libs import detokenize
+from thot_utils.libs import thot_preproc
+from thot_utils.libs.utils import split_string_to_words
+from thot_utils.libs.utils import transform_word
+
+SUBJECTS = ['John', 'Mary', 'Dr. Smith', 'New York', 'Google', 'the U.N.', "It's"]
+VERBS = ['said', 'paid', 'bought', 'saw', 'visited', 'wrote', 'sold']
+OBJECTS = ['the book', 'a car', '3 apples', '12.5 kg', '$100', 'the house', 'an e-mail', '"the report"']
+ADVERBS = ['yesterday', '(today)', 'at 10a.m.', 'on Jan. 3rd', 'in 2010', 'quickly', 'again']
+
+CONFIGURATIONS = [
+    ('best-first', dict(search='best-first', future_cost=False)),
+    ('best-first + A*', dict(search='best-first')),
+    ('viterbi', dict(search='viterbi')),
+    ('beam 5', dict(search='beam', beam_width=5)),
+]
+
+
+def sentence(rand):
+    words = [rand.choice(SUBJECTS), rand.choice(VERBS), rand.choice(OBJECTS)]
+    if rand.random() < 0.5:
+        words.append(rand.choice([',', '']) + rand.choice(ADVERBS))
+    if rand.random() < 0.3:
+        words += ['and', rand.choice(VERBS), rand.choice(OBJECTS)]
+    return ' '.join(words).replace(' ,', ',') + rand.choice(['.', '!', '?', '...'])
+
+
+def corpus(size, seed):
+    rand = random.Random(seed)
+    raw = [sentence(rand) for _ in range(size)]
+    return raw, [' '.join(thot_preproc.tokenize(line)) for line in raw]
+
+
+def build_models(filename):
+    raw, tokenized = corpus(3000, 1)
+    tm_provider = detokenize.TranslationModelDBProvider(filename)
+    tm_provider.load_from_other_provider(detokenize.TranslationModelFileProvider(
+        raw_fd=io.StringIO('\n'.join(raw)), tokenized_fd=io.StringIO('\n'.join(tokenized))
+    ))
+    lm_provider = detokenize.LanguageModelDBProvider(filename)
+    lm_provider.load_from_other_provider(detokenize.LanguageModelFileProvider(
+        raw_fd=io.StringIO('\n'.join(raw)), tokenized_fd=io.StringIO('\n'.join(tokenized)), ngrams_length=2
+    ))
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'detokenize.db')
+        build_models(filename)
+        # Longer and more ambiguous inputs than the training sentences
+        _, tokenized = corpus(400, 2)
+        sentences = [
+            [transform_word(word) for word in split_string_to_words(' '.join(tokenized[i:i + 4]))]
+            for i in range(0, len(tokenized), 4)
+        ]
+
+        print("%-16s %12s %10s" % ("search", "expansions", "time (s)"))
+        reference = None
+        for name, kwargs in CONFIGURATIONS:
+            decoder = thot_preproc.Decoder(
+                thot_preproc.TransModel(detokenize.TranslationModelDBProvider(filename)),
+                thot_preproc.LangModel(detokenize.LanguageModelDBProvider(filename), ngrams_length=2),
+                [1, 1, 1, 1], **kwargs
+            )
+            scores = []
+            elapsed = timeit.timeit(
+                lambda: scores.extend(decoder.obtain_nblist(words, 1, False)[0].score for words in sentences),
+                number=1,
+            )
+            print("%-16s %12d %10.3f" % (name, decoder.counters['expansions'], elapsed))
+            if reference is None:
+                reference = scores
+            elif kwargs['search'] != 'beam':
+                assert all(abs(a - b) < 1e-6 for a, b in zip(reference, scores))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# -*- coding:utf-8 -*-
+"""
+Compares Tokenizer.tokenize against the previous findall()-based
+implementation on increasingly long lines, and the regex and trie atom
+engines on increasingly long atom lists.
+
+Usage: PYTHONPATH=. python benchmarks/bench_tokenizer.py
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import timeit
+
+from thot_utils.libs.thot_preproc import Tokenizer
+from thot_utils.libs.thot_preproc import default_atoms
+from thot_utils.libs.thot_preproc import get_tokenizer
+
+SAMPLE = u'Mr. Smith paid 1,50EUR (approx.) at 10a.m. on Jan. 3rd -- "great" deal!!! :) '
+
+
+def findall_tokenize(tokenizer, text):
+    # Previous implementation: each match is searched again in the
+    # remaining suffix of the text
+    matches = tokenizer.re.findall(text)
+    tokens = []
+    p = 0
+    for match in matches:
+        mp = text[p:].find(match)
+        if mp != 0:
+            missed = text[p:p + mp]
+            tokens.append(missed)
+        p = p + mp + len(match)
+        tokens.append(match)
+
+    if p < len(text):
+        tokens.append(text[p:])
+    return list(filter(lambda s: s.strip(), tokens))
+
+
+def gap_filling():
+    tokenizer = get_tokenizer()
+    print("%10s %14s %14s %8s" % ("chars", "findall (ms)", "finditer (ms)", "speedup"))
+    for repeat in (1, 10, 100, 1000):
+        text = SAMPLE * repeat
+        assert findall_tokenize(tokenizer, text) == tokenizer.tokenize(text)
+        number = max(1, 1000 // repeat)
+        old = min(timeit.repeat(lambda: findall_tokenize(tokenizer, text), number=number, repeat=3)) / number
+        new = min(timeit.repeat(lambda: tokenizer.tokenize(text), number=number, repeat=3)) / number
+        print("%10d %14.3f %14.3f %7.1fx" % (len(text), old * 1000, new * 1000, old / new))
+
+
+def atom_engines():
+    text = SAMPLE * 100
+    print("%10s %14s %14s" % ("atoms", "regex (ms)", "trie (ms)"))
+    for extra in (0, 1000, 10000, 50000):
+        atoms = default_atoms + ["PRD-%05d" % i for i in range(extra)]
+        regex_tokenizer = Tokenizer(atoms=atoms, engine='regex')
+        trie_tokenizer = Tokenizer(atoms=atoms, engine='trie')
+        assert regex_tokenizer.tokenize(text) == trie_tokenizer.tokenize(text)
+        regex = min(timeit.repeat(lambda: regex_tokenizer.tokenize(text), number=5, repeat=3)) / 5
+        trie = min(timeit.repeat(lambda: trie_tokenizer.tokenize(text), number=5, repeat=3)) / 5
+        print("%10d %14.3f %14.3f" % (len(atoms), regex * 1000, trie * 1000))
+
+
+def main():
+    gap_filling()
+    print("")
+    atom_engines()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# -*- coding:utf-8 -*-
+"""
+Compares annotated_string_to_xml_skeleton against the previous
+generator-based implementation on lines with and without annotations.
+
+Usage: PYTHONPATH=. python benchmarks/bench_xml_skeleton.py
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import timeit
+
+from thot_utils.libs import config
+from thot_utils.libs.thot_preproc import annotated_string_to_xml_skeleton
+
+PLAIN = u'320GB SATA 2.5" Hard Disc Drive Upgrade For HP Compaq Presario CQ42-108TU Laptop'
+ANNOTATED = u'<length_limit>80</length_limit>' + PLAIN
+
+
+def regex_skeleton(annotated):
+    # Previous implementation: always runs the annotation regex and builds
+    # list-of-list entries
+    offset = 0
+    for m in config._annotation.finditer(annotated):
+        if offset < m.start():
+            yield [False, annotated[offset:m.start()]]
+        offset = m.end()
+        g = m.groups()
+        dic_g = [x for x in g[0:8] if x]
+        len_g = [x for x in g[8:11] if x]
+        if dic_g:
+            for is_tag, text in zip((True, True, False, True, True, False, True, True), dic_g):
+                yield [is_tag, text]
+        elif len_g:
+            for is_tag, text in zip((True, False, True), len_g):
+                yield [is_tag, text]
+    if offset < len(annotated):
+        yield [False, annotated[offset:]]
+
+
+def main():
+    number = 100000
+    print("%12s %12s %12s %8s" % ("input", "old (us)", "new (us)", "speedup"))
+    for name, line in (("plain", PLAIN), ("annotated", ANNOTATED)):
+        assert [tuple(item) for item in regex_skeleton(line)] == list(annotated_string_to_xml_skeleton(line))
+        old = min(timeit.repeat(lambda: list(regex_skeleton(line)), number=number, repeat=3)) / number
+        new = min(timeit.repeat(lambda: annotated_string_to_xml_skeleton(line), number=number, repeat=3)) / number
+        print("%12s %12.3f %12.3f %7.1fx" % (name, old * 1e6, new * 1e6, old / new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from thot_utils.libs.thot_preproc import categorize
+from thot_utils.libs.thot_preproc import categorize_text
+from thot_utils.libs.thot_preproc import categorize_word
+
+
+def test_categorize_text_matches_categorize_word():
+    words = ['7', '42', '-4.2e3', 'inf', '+NaN', 'infinit', 'A4', 'x-1', '-1x', '²', '½', 'hello', 'wonderful']
+    assert categorize_text(' '.join(words)).split() == [categorize_word(word) for word in words]
+
+
+def test_categorize():
+    assert categorize('I paid  12 EUR for 2 A4\tpads') == 'I paid <number> EUR for <digit> <alfanum> pads'
+    assert categorize('<length_limit>7</length_limit> 7') == '<length_limit> 7 </length_limit> <digit>'
+
+
+def test_categorize_annotation_pairing():
+    paired = '<phr_pair_annot><src_segm>5 apples</src_segm><trg_segm>5 manzanas</trg_segm></phr_pair_annot>'
+    assert categorize(paired) == (
+        '<phr_pair_annot> <src_segm> <digit> apples </src_segm> <trg_segm> <digit> manzanas </trg_segm> '
+        '</phr_pair_annot>'
+    )
+    unpaired = '<phr_pair_annot><src_segm>5 apples</src_segm><trg_segm>five manzanas</trg_segm></phr_pair_annot>'
+    assert categorize(unpaired) == (
+        '<phr_pair_annot> <src_segm> 5 apples </src_segm> <trg_segm> five manzanas </trg_segm> </phr_pair_annot>'
+    )
@@ -0,0 +1,30 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from thot_utils.libs import config
+from thot_utils.libs.thot_preproc import categorize_word
+from thot_utils.libs.utils import classify_word
+from thot_utils.libs.utils import transform_word
+
+
+def test_classify_word():
+    assert classify_word('7') == config.digit_str
+    assert classify_word('42') == config.number_str
+    assert classify_word('-4.2e3') == config.number_str
+    assert classify_word('inf') == config.number_str
+    assert classify_word('1_000') == config.number_str
+    assert classify_word('A4') == config.alfanum_str
+    assert classify_word('x-1') == config.alfanum_str
+    assert classify_word('-1x') is None
+    assert classify_word('½') is None
+    assert classify_word('hello') is None
+
+
+def test_transform_and_categorize_word():
+    assert transform_word('hello') == 'hello'
+    assert transform_word('wonderful') == config.common_word_str
+    assert transform_word('½') == '½'
+    assert categorize_word('wonderful') == 'wonderful'
+    assert categorize_word('12') == config.number_str
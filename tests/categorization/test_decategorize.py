@@ -0,0 +1,43 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import pytest
+
+from thot_utils.libs.thot_preproc import Decategorizer
+from thot_utils.libs.thot_preproc import decategorize
+from thot_utils.libs.thot_preproc import decategorize_word
+from thot_utils.libs.thot_preproc import parse_alig_info
+
+SRC = '3 apples cost 12 EUR and 5 pears 7 EUR'
+HYP = 'x | Source Segmentation: ( 1 , 5 ) ( 6 , 10 ) | Target Segmentation: 5 10 |'
+
+
+def test_decategorize():
+    trg = '<digit> manzanas cuestan <number> EUR y <digit> peras <digit> EUR'
+    assert decategorize(SRC, trg, HYP) == '3 manzanas cuestan 12 EUR y 5 peras 7 EUR'
+
+
+def test_decategorize_word():
+    trg_word_array = '<digit> manzanas cuestan <number> EUR y <digit> peras <digit> EUR'.split()
+    assert decategorize_word(8, SRC.split(), trg_word_array, [(1, 5), (6, 10)], [5, 10]) == '7'
+
+
+def test_unaligned_categories_are_kept():
+    trg = '<digit> manzanas cuestan <number> EUR y <digit> peras <digit> EUR <digit>'
+    assert decategorize(SRC, trg, HYP) == '3 manzanas cuestan 12 EUR y 5 peras 7 EUR <digit>'
+    assert decategorize(SRC, trg, 'no alignment') == trg
+    assert Decategorizer(SRC.split(), (), ()).decategorize(['<digit>']) == ['<digit>']
+
+
+def test_parse_alig_info():
+    srcsegms, trgcuts = parse_alig_info(HYP.split())
+    assert list(srcsegms) == [1, 5, 6, 10]
+    assert list(trgcuts) == [5, 10]
+    srcsegms, trgcuts = parse_alig_info('no alignment'.split())
+    assert len(srcsegms) == len(trgcuts) == 0
+    with pytest.raises(ValueError):
+        parse_alig_info('| Source Segmentation: ( 1 , x ) | Target Segmentation: 3 |'.split())
+    with pytest.raises(ValueError):
+        parse_alig_info('| Source Segmentation: ( 1 , 3 ) | Target Segmentation: 3'.split())
@@ -0,0 +1,37 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+
+from thot_utils.libs import recase
+from thot_utils.libs.bloom_filter import BloomFilter
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter.for_capacity(1000, error_rate=0.01)
+    items = ['word%d' % i for i in range(1000)] + [u'señor', '']
+    for item in items:
+        bloom_filter.add(item)
+    assert all(item in bloom_filter for item in items)
+    false_positives = sum('other%d' % i in bloom_filter for i in range(10000))
+    assert false_positives < 300
+
+    copy = BloomFilter(bloom_filter.num_bits, bloom_filter.num_hashes, bloom_filter.to_bytes())
+    assert all(item in copy for item in items)
+
+
+def test_provider_bloom_filter(tmpdir):
+    filename = str(tmpdir.join('recase.db'))
+    provider = recase.TranslationModelDBProvider(filename)
+    provider.load_from_other_provider(recase.TranslationModelFileProvider(io.StringIO('Hello, Mary!\nHello world')))
+    provider = recase.TranslationModelDBProvider(filename)
+    assert provider.bloom_filter is not None
+    assert provider.get_options('hello') == (1, [('Hello', 1)])
+    assert provider.get_options_batch(['world', 'hello world', 'mary! hello']) == {
+        'world': (1, [('world', 1)]), 'hello world': (0, []), 'mary! hello': (0, [])
+    }
+    assert provider.counters['bloom filter lookups'] == 4
+    assert provider.counters['bloom filter rejections'] >= 1
+    assert provider.stats()[0].startswith("Bloom filter: ")
@@ -0,0 +1,324 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import math
+
+import pytest
+
+from thot_utils.libs import detokenize
+from thot_utils.libs import recase
+from thot_utils.libs import thot_preproc
+from thot_utils.libs.utils import MemoryBudget
+
+RAW = [
+    'Mr. Smith said "hello, world!" to Mary.',
+    'Mary said hello to Mr. Smith.',
+    'The world is big, isn\'t it?',
+    'Hello, Mary!',
+]
+TOKENIZED = [' '.join(thot_preproc.tokenize(line)) for line in RAW]
+
+
+@pytest.fixture
+def detokenize_models(tmpdir):
+    filename = str(tmpdir.join('detokenize.db'))
+    tm_provider = detokenize.TranslationModelDBProvider(filename)
+    tm_provider.load_from_other_provider(detokenize.TranslationModelFileProvider(
+        raw_fd=io.StringIO('\n'.join(RAW)), tokenized_fd=io.StringIO('\n'.join(TOKENIZED))
+    ))
+    lm_provider = detokenize.LanguageModelDBProvider(filename)
+    lm_provider.load_from_other_provider(detokenize.LanguageModelFileProvider(
+        raw_fd=io.StringIO('\n'.join(RAW)), tokenized_fd=io.StringIO('\n'.join(TOKENIZED)), ngrams_length=2
+    ))
+    tmodel = thot_preproc.TransModel(tm_provider)
+    lmodel = thot_preproc.LangModel(lm_provider, ngrams_length=2)
+    return tmodel, lmodel
+
+
+@pytest.fixture
+def detokenizer(detokenize_models):
+    return thot_preproc.Decoder(detokenize_models[0], detokenize_models[1], [1, 0, 0, 1])
+
+
+@pytest.fixture
+def recase_models(tmpdir):
+    filename = str(tmpdir.join('recase.db'))
+    tm_provider = recase.TranslationModelDBProvider(filename)
+    tm_provider.load_from_other_provider(recase.TranslationModelFileProvider(io.StringIO('\n'.join(RAW))))
+    lm_provider = recase.LanguageModelDBProvider(filename)
+    lm_provider.load_from_other_provider(
+        recase.LanguageModelFileProvider(io.StringIO('\n'.join(RAW)), ngrams_length=2)
+    )
+    tmodel = thot_preproc.TransModel(tm_provider)
+    lmodel = thot_preproc.LangModel(lm_provider, ngrams_length=2)
+    return tmodel, lmodel
+
+
+@pytest.fixture
+def recaser(recase_models):
+    return thot_preproc.Decoder(recase_models[0], recase_models[1], [0, 0, 0, 1])
+
+
+def test_vocabulary():
+    vocab = thot_preproc.Vocabulary()
+    ids = vocab.to_ids(['a', 'b', 'a'])
+    assert ids == (0, 1, 0)
+    assert vocab.to_words(ids) == ['a', 'b', 'a']
+    assert len(vocab) == 2
+
+
+def test_extend_lm_state():
+    assert thot_preproc.LangModel(None, ngrams_length=1).extend_lm_state((), (1, 2)) == ()
+    assert thot_preproc.LangModel(None, ngrams_length=2).extend_lm_state((1,), (2, 3)) == (3,)
+    assert thot_preproc.LangModel(None, ngrams_length=3).extend_lm_state((1,), (2, 3)) == (2, 3)
+
+
+def test_detokenize(detokenizer):
+    assert [detokenizer.detokenize(line) for line in TOKENIZED] == RAW
+
+
+def test_recase(recaser):
+    assert recaser.recase('hello, mary! mr. smith said hello to mary.', False) == \
+        'Hello, Mary! Mr. Smith said hello to Mary.'
+
+
+def test_viterbi_search(detokenize_models, recase_models):
+    detokenizer = thot_preproc.Decoder(detokenize_models[0], detokenize_models[1], [1, 0, 0, 1], search='viterbi')
+    recaser = thot_preproc.Decoder(recase_models[0], recase_models[1], [0, 0, 0, 1], search='viterbi')
+    best_first_recaser = thot_preproc.Decoder(recase_models[0], recase_models[1], [0, 0, 0, 1])
+    assert [detokenizer.detokenize(line) for line in TOKENIZED] == RAW
+    line = 'hello, mary! mr. smith said hello to mary.'
+    assert recaser.recase(line, False) == best_first_recaser.recase(line, False)
+    src_word_array = line.split()
+    assert recaser.obtain_nblist(src_word_array, 1, False)[0].score == \
+        pytest.approx(best_first_recaser.obtain_nblist(src_word_array, 1, False)[0].score)
+
+
+def test_beam_search(recase_models):
+    recaser = thot_preproc.Decoder(recase_models[0], recase_models[1], [0, 0, 0, 1], search='beam', beam_width=1)
+    assert recaser.recase('hello, mary!', False) == 'Hello, Mary!'
+
+    hyps = []
+    for score in (-3.0, -1.0, -2.0, -9.0):
+        hyp = thot_preproc.Hypothesis()
+        hyp.score = score
+        hyps.append(hyp)
+    stack = dict(enumerate(hyps))
+    recaser.beam_width = 2
+    assert [hyp.score for hyp in recaser.prune_stack(stack)] == [-1.0, -2.0]
+    recaser.beam_width = 10
+    recaser.beam_threshold = 5.0
+    assert [hyp.score for hyp in recaser.prune_stack(stack)] == [-1.0, -2.0, -3.0]
+
+
+def test_beam_search_bounds_expansions(tmpdir):
+    # Every word has three casings, so every stack has three LM states
+    raw = ['Apple pie is good', 'apple PIE IS Good', 'APPLE Pie Is GOOD']
+    filename = str(tmpdir.join('ambiguous.db'))
+    tm_provider = recase.TranslationModelDBProvider(filename)
+    tm_provider.load_from_other_provider(recase.TranslationModelFileProvider(io.StringIO('\n'.join(raw))))
+    lm_provider = recase.LanguageModelDBProvider(filename)
+    lm_provider.load_from_other_provider(
+        recase.LanguageModelFileProvider(io.StringIO('\n'.join(raw)), ngrams_length=2)
+    )
+    tmodel = thot_preproc.TransModel(tm_provider)
+    lmodel = thot_preproc.LangModel(lm_provider, ngrams_length=2)
+
+    src_word_array = 'apple pie is good apple pie is good'.split()
+    beam_width = 1
+    expansions = {}
+    for search in ('viterbi', 'beam'):
+        decoder = thot_preproc.Decoder(tmodel, lmodel, [0, 0, 0, 1], search=search, beam_width=beam_width)
+        assert decoder.obtain_nblist(src_word_array, 1, False)
+        expansions[search] = decoder.counters['expansions']
+    assert expansions['beam'] < expansions['viterbi']
+    assert expansions['beam'] <= len(src_word_array) * beam_width + 1
+
+
+def test_invalid_beam_parameters(recase_models):
+    tmodel, lmodel = recase_models
+    for beam_width in (0, -1):
+        with pytest.raises(ValueError):
+            thot_preproc.Decoder(tmodel, lmodel, [0, 0, 0, 1], search='beam', beam_width=beam_width)
+    with pytest.raises(ValueError):
+        thot_preproc.Decoder(tmodel, lmodel, [0, 0, 0, 1], search='beam', beam_threshold=-1.0)
+    thot_preproc.Decoder(tmodel, lmodel, [0, 0, 0, 1], search='beam', beam_width=1, beam_threshold=0.0)
+
+
+def test_get_options(detokenize_models):
+    db_provider = detokenize_models[0].model_provider
+    file_provider = detokenize.TranslationModelFileProvider(
+        raw_fd=io.StringIO('\n'.join(RAW)), tokenized_fd=io.StringIO('\n'.join(TOKENIZED))
+    )
+    srcs = ['Smith .', 'hello', '" hello', 'unknown']
+    for provider in (db_provider, file_provider):
+        options = provider.get_options_batch(srcs)
+        assert set(options) == set(srcs)
+        for src in srcs:
+            expected = (
+                provider.get_source_count(src),
+                [(trg, provider.get_target_count(src, trg)) for trg in provider.get_targets(src)]
+            )
+            src_count, opt_counts = provider.get_options(src)
+            assert src_count == options[src][0] == expected[0]
+            assert sorted(opt_counts) == sorted(options[src][1]) == sorted(expected[1])
+        assert options['unknown'] == (0, [])
+
+
+def test_build_lattice(detokenize_models):
+    detokenizer = thot_preproc.Decoder(detokenize_models[0], detokenize_models[1], [1, 0, 0, 1])
+    lattice = detokenizer.build_lattice('Hello , unknown'.split())
+    assert set(lattice) == set([(0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2)])
+    assert [opt for opt, _, _ in lattice[0, 1]] == ['Hello,']
+    # Unknown words are translated as themselves
+    assert [opt for opt, _, _ in lattice[2, 2]] == ['unknown']
+    assert lattice[1, 2] == []
+
+
+def test_phrase_trie(detokenize_models):
+    detokenizer = thot_preproc.Decoder(detokenize_models[0], detokenize_models[1], [1, 0, 0, 1], phrase_trie=True)
+    tok_array = 'Hello , unknown'.split()
+    # Only the spans that are sources of the model and the single words are
+    # looked up
+    assert detokenizer.obtain_span_ends(tok_array) == [[0, 1], [1], [2]]
+    assert detokenizer.counters['spans pruned'] == 2
+    lattice = detokenizer.build_lattice(tok_array)
+    assert set(lattice) == set([(0, 0), (0, 1), (1, 1), (2, 2)])
+    assert [opt for opt, _, _ in lattice[0, 1]] == ['Hello,']
+
+    no_trie_detokenizer = thot_preproc.Decoder(detokenize_models[0], detokenize_models[1], [1, 0, 0, 1])
+    assert no_trie_detokenizer.source_trie is None
+    for line in TOKENIZED:
+        assert detokenizer.detokenize(line) == no_trie_detokenizer.detokenize(line)
+
+
+def test_caches(recase_models):
+    recaser = thot_preproc.Decoder(recase_models[0], recase_models[1], [0, 0, 0, 1])
+    uncached_recaser = thot_preproc.Decoder(
+        recase_models[0], recase_models[1], [0, 0, 0, 1], lm_cache_size=0, tm_cache_size=0
+    )
+    for line in ['hello, mary!', 'mr. smith said hello to mary.', 'hello, mary!']:
+        src_word_array = line.split()
+        assert recaser.obtain_nblist(src_word_array, 1, False)[0].score == \
+            uncached_recaser.obtain_nblist(src_word_array, 1, False)[0].score
+    assert recaser.lm_cache.hits > 0
+    assert recaser.tm_cache.hits > 0
+    assert [line.split(':')[0] for line in recaser.stats()] == [
+        'Expanded hypotheses', 'Pushes avoided by recombination', 'LM cache', 'TM cache', 'Bloom filter'
+    ]
+    assert [line.split(':')[0] for line in uncached_recaser.stats()] == [
+        'Expanded hypotheses', 'Pushes avoided by recombination', 'Bloom filter'
+    ]
+
+
+def test_future_cost(detokenize_models):
+    src_word_array = 'Mary said hello , world . Hello to Mr. Smith !'.split()
+    scores = []
+    for kwargs in [dict(future_cost=False), dict(future_cost=True), dict(search='viterbi')]:
+        decoder = thot_preproc.Decoder(detokenize_models[0], detokenize_models[1], [1, 1, 1, 1], **kwargs)
+        scores.append(decoder.obtain_nblist(src_word_array, 1, False)[0].score)
+        if kwargs.get('future_cost'):
+            future_cost = decoder.future_cost
+    assert scores[1] == pytest.approx(scores[0])
+    assert scores[2] == pytest.approx(scores[0])
+    # The estimation is optimistic
+    assert len(future_cost) == len(src_word_array) + 1
+    assert future_cost[-1] == 0
+    assert future_cost[0] >= scores[0]
+
+
+def test_future_cost_saves_expansions(detokenize_models):
+    decoder = thot_preproc.Decoder(detokenize_models[0], detokenize_models[1], [1, 1, 1, 1], future_cost=False)
+    astar_decoder = thot_preproc.Decoder(detokenize_models[0], detokenize_models[1], [1, 1, 1, 1], future_cost=True)
+    for line in TOKENIZED + [' '.join(TOKENIZED)]:
+        src_word_array = line.split()
+        expansions = decoder.counters['expansions']
+        astar_expansions = astar_decoder.counters['expansions']
+        assert astar_decoder.obtain_nblist(src_word_array, 1, False)[0].score == \
+            pytest.approx(decoder.obtain_nblist(src_word_array, 1, False)[0].score)
+        assert astar_decoder.counters['expansions'] - astar_expansions <= decoder.counters['expansions'] - expansions
+    assert astar_decoder.counters['expansions'] < decoder.counters['expansions']
+
+
+def test_state_info_dict():
+    stdict = thot_preproc.StateInfoDict()
+    assert stdict.empty()
+    stdict.insert((0, (1, 2)), -2.0)
+    stdict.insert((0, (1, 2)), -3.0)
+    assert stdict.hyp_dominated((0, (1, 2)), -2.0)
+    assert not stdict.hyp_recombined((0, (1, 2)), -2.0)
+    assert stdict.hyp_recombined((0, (1, 2)), -2.5)
+    assert not stdict.hyp_dominated((1, (1, 2)), -5.0)
+
+
+def test_recombination_at_insertion(detokenizer):
+    src_word_array = TOKENIZED[1].split()
+    detokenizer.obtain_nblist(src_word_array, 1, False)
+    hyp = detokenizer.initial_hypothesis()
+    stdict = thot_preproc.StateInfoDict()
+    pushes_avoided = detokenizer.counters['pushes avoided']
+    expansions = detokenizer.expand(src_word_array, hyp, 0, False, stdict)
+    assert expansions
+    # Expanding again reaches the same states with the same scores
+    assert detokenizer.expand(src_word_array, hyp, 0, False, stdict) == []
+    assert detokenizer.counters['pushes avoided'] == pushes_avoided + len(expansions)
+
+
+def test_hypothesis_back_pointers(detokenizer):
+    src_word_array = TOKENIZED[1].split()
+    best_hyp = detokenizer.obtain_nblist(src_word_array, 1, False)[0]
+    assert not hasattr(best_hyp, '__dict__')
+    coverage = detokenizer.hyp_coverage(best_hyp)
+    assert coverage[-1] == best_hyp.last_cov_pos == len(src_word_array) - 1
+    assert coverage == sorted(coverage)
+    assert detokenizer.hyp_to_str(best_hyp).startswith("cov: " + " ".join(str(pos) for pos in coverage) + " ;")
+
+
+def test_precalculated_logprobs(tmpdir):
+    filename = str(tmpdir.join('recase.db'))
+    file_provider = recase.LanguageModelFileProvider(io.StringIO('\n'.join(RAW)), ngrams_length=2)
+    lm_provider = recase.LanguageModelDBProvider(filename)
+    lm_provider.load_from_other_provider(file_provider)
+    lmodel = thot_preproc.LangModel(lm_provider, ngrams_length=2)
+    assert not lmodel.use_logprobs
+
+    lm_provider.load_logprobs_from_other_provider(file_provider, ngrams_length=2, interp_prob=0.5)
+    precalculated_lmodel = thot_preproc.LangModel(lm_provider, ngrams_length=2, interp_prob=0.5)
+    assert precalculated_lmodel.use_logprobs
+    for ngram in ['', 'Mary', '<bos> Mary', 'said hello', 'hello Mary', 'unseen Mary', 'unseen', 'Mary unseen']:
+        assert precalculated_lmodel.obtain_trgsrc_interp_logprob(ngram) == \
+            pytest.approx(math.log(lmodel.obtain_trgsrc_interp_prob(ngram)))
+
+    # The logprobs are ignored if they were obtained with other parameters
+    assert not thot_preproc.LangModel(lm_provider, ngrams_length=2, interp_prob=0.3).use_logprobs
+
+
+def test_preload(recase_models):
+    tm_provider = recase_models[0].model_provider
+    lm_provider = recase_models[1].provider
+    srcs = ['hello,', 'mary', 'unknown']
+    ngrams = ['', 'Mary', '<bos> Mary', 'unknown']
+    options = tm_provider.get_options_batch(srcs)
+    counts = [lm_provider.get_count(ngram) for ngram in ngrams]
+
+    # Tables exceeding the limit are still read from sqlite
+    budget = MemoryBudget(max_bytes=100)
+    assert not tm_provider.preload(budget)
+    assert not lm_provider.preload(budget)
+    assert budget.size == 0
+    assert tm_provider.st_counts is None and lm_provider.ngram_counts is None
+
+    budget = MemoryBudget()
+    assert tm_provider.preload(budget)
+    assert lm_provider.preload(budget)
+    assert budget.size > 0
+    preloaded_options = tm_provider.get_options_batch(srcs)
+    for src in srcs:
+        assert preloaded_options[src][0] == options[src][0]
+        assert sorted(preloaded_options[src][1]) == sorted(options[src][1])
+        assert tm_provider.get_source_count(src) == options[src][0]
+        assert sorted(tm_provider.get_targets(src)) == sorted(trg for trg, _ in options[src][1])
+    assert [lm_provider.get_count(ngram) for ngram in ngrams] == counts
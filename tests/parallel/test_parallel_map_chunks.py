@@ -0,0 +1,48 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import uuid
+
+from thot_utils.bin.thot_tokenize import init_tokenizer
+from thot_utils.bin.thot_tokenize import tokenize_chunk
+from thot_utils.libs.parallel import parallel_map_chunks
+from thot_utils.libs.thot_preproc import tokenize
+from thot_utils.libs.utils import LRUCache
+
+
+def test_parallel_tokenization_keeps_input_order():
+    lines = ['line %d: Mr. Smith paid %d,50EUR :)' % (i, i) for i in range(250)]
+    tok_sents = parallel_map_chunks(
+        tokenize_chunk, lines, jobs=3, chunk_size=7, initializer=init_tokenizer, initargs=(None, 'trie')
+    )
+    assert list(tok_sents) == [' '.join(tokenize(line)) for line in lines]
+
+
+def test_cached_results_keep_input_order():
+    lines = ['Mr. %d :)' % (i // 10 % 7) for i in range(200)]
+    for jobs in (1, 2):
+        cache = LRUCache(5)
+        tok_sents = parallel_map_chunks(
+            tokenize_chunk, lines, jobs=jobs, chunk_size=9, initializer=init_tokenizer, initargs=(None, 'regex'),
+            cache=cache
+        )
+        assert list(tok_sents) == [' '.join(tokenize(line)) for line in lines]
+        assert cache.hits > 0
+        assert len(cache) == 5
+
+
+def tag_chunk(chunk):
+    # Each call tags its results, so that repeated computations differ
+    tag = uuid.uuid4().hex
+    return ['%s %s' % (item, tag) for item in chunk]
+
+
+def test_repeated_misses_are_computed_once():
+    lines = ['Mr. Smith'] * 3000
+    cache = LRUCache(5)
+    results = list(parallel_map_chunks(tag_chunk, lines, jobs=2, chunk_size=100, cache=cache))
+    assert len(results) == len(lines)
+    assert len(set(results)) == 1
+    assert cache.hits > 0
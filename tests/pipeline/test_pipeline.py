@@ -0,0 +1,36 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import itertools
+
+from thot_utils.libs.pipeline import Pipeline
+from thot_utils.libs.thot_preproc import categorize
+from thot_utils.libs.thot_preproc import lowercase
+from thot_utils.libs.thot_preproc import tokenize
+
+LINES = [
+    'Mr. Smith PAID 1,50EUR at 10a.m. on Jan. 3rd :)',
+    '<length_limit>80</length_limit>320GB SATA 2.5" Hard Disc Drive x86',
+    '<phr_pair_annot><src_segm>Pay 12 EUR!</src_segm><trg_segm>Paga 12 EUR!</trg_segm></phr_pair_annot> now',
+    '<length_limit>8</length_limit><phr_pair_annot> <src_segm>A4</src_segm> <trg_segm>B5</trg_segm> </phr_pair_annot>',
+    '',
+]
+
+STAGE_FUNCTIONS = {
+    'tokenize': lambda line: ' '.join(tokenize(line)),
+    'lowercase': lowercase,
+    'categorize': categorize,
+}
+
+
+def test_pipeline_matches_chained_stages():
+    for length in (1, 2, 3):
+        for stages in itertools.permutations(STAGE_FUNCTIONS, length):
+            pipeline = Pipeline(stages)
+            for line in LINES:
+                expected = line
+                for stage in stages:
+                    expected = STAGE_FUNCTIONS[stage](expected)
+                assert pipeline.process(line).split() == expected.split()
@@ -14,9 +14,15 @@ def test_string_with_tags():
     s = '<length_limit>80</length_limit>320GB SATA 2.5" ' \
         'Hard Disc Drive Upgrade For HP Compaq Presario CQ42-108TU Laptop'
     expected = [
-        [True, '<length_limit>'],
-        [False, '80'],
-        [True, '</length_limit>'],
-        [False, '320GB SATA 2.5" Hard Disc Drive Upgrade For HP Compaq Presario CQ42-108TU Laptop']
+        (True, '<length_limit>'),
+        (False, '80'),
+        (True, '</length_limit>'),
+        (False, '320GB SATA 2.5" Hard Disc Drive Upgrade For HP Compaq Presario CQ42-108TU Laptop')
     ]
     assert list(annotated_string_to_xml_skeleton(s)) == expected
+
+
+def test_string_without_tags():
+    s = '320GB SATA 2.5" Hard Disc Drive Upgrade For HP Compaq Presario CQ42-108TU Laptop'
+    assert list(annotated_string_to_xml_skeleton(s)) == [(False, s)]
+    assert list(annotated_string_to_xml_skeleton('')) == []
@@ -0,0 +1,56 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from thot_utils.libs.thot_preproc import Tokenizer
+from thot_utils.libs.thot_preproc import default_atoms
+from thot_utils.libs.thot_preproc import get_tokenizer
+from thot_utils.libs.thot_preproc import tokenize
+from thot_utils.libs.thot_preproc import tokenize_many
+from thot_utils.libs.thot_preproc import tokenize_spans
+
+LINES = [
+    'Mr. Smith paid 1,50EUR at 10a.m. :)',
+    '<length_limit>80</length_limit>320GB SATA 2.5" Hard Disc Drive',
+    '<phr_pair_annot><src_segm>Hello, world!</src_segm><trg_segm>Hola, mundo!</trg_segm></phr_pair_annot> ok',
+    '',
+]
+
+
+def test_tokenize():
+    assert tokenize(LINES[0]) == ['Mr.', 'Smith', 'paid', '1,50EUR', 'at', '10a.m.', ':)']
+
+
+def test_tokenize_many_matches_tokenize():
+    assert list(tokenize_many(LINES)) == [tokenize(line) for line in LINES]
+
+
+def test_get_tokenizer_is_shared():
+    assert get_tokenizer() is get_tokenizer()
+    assert get_tokenizer(atoms=['a.b.']) is get_tokenizer(atoms=['a.b.'])
+    assert get_tokenizer(atoms=['a.b.']) is not get_tokenizer()
+
+
+def test_trie_engine_matches_regex_engine():
+    atoms = default_atoms + ['SKU-%d/x' % i for i in range(2000)] + ['a', 'ab', "o'", '<+>', "'s'", u'σοφος']
+    regex_tokenizer = Tokenizer(atoms=atoms, engine='regex')
+    trie_tokenizer = Tokenizer(atoms=atoms, engine='trie')
+    texts = LINES + [
+        'I.E. vs. i.e. E.g. MR. mr. 12pm 12PM sku-17/X SKU-1999/x,SKU-2000/x',
+        'ab abc aab <+><3 <333 :-)) o\'clock (^_^) 1,5kg 1,5',
+        u'Señor Ñandú (Ga.) ΣΟΦΙΑ İstanbul',
+        # Characters that re.IGNORECASE matches although their lowercase
+        # forms differ
+        u"x 'ſ' y 'S' ΣΟΦΟΣ σοφοσ σοφος \u212a",
+    ]
+    for text in texts:
+        assert trie_tokenizer.tokenize(text) == regex_tokenizer.tokenize(text)
+
+
+def test_tokenize_spans():
+    for engine in ('regex', 'trie'):
+        tokenizer = get_tokenizer(engine=engine)
+        for line in LINES:
+            spans = tokenize_spans(line, tokenizer)
+            assert [line[start:end] for start, end in spans] == tokenize(line)
@@ -11,6 +11,9 @@ import sys
 
 from thot_utils.libs import thot_preproc
 from thot_utils.libs.file_input import FileInput
+from thot_utils.libs.parallel import DEFAULT_CHUNK_SIZE
+from thot_utils.libs.parallel import parallel_map_chunks
+from thot_utils.libs.utils import LRUCache
 
 argparser = argparse.ArgumentParser(description=__doc__)
 mutex_group = argparser.add_mutually_exclusive_group(required=True)
@@ -28,6 +31,33 @@ mutex_group.add_argument(
     help='Read model from standard input',
 )
 
+argparser.add_argument(
+    '-j',
+    '--jobs',
+    type=int,
+    default=1,
+    help='Number of worker processes (1 by default)',
+)
+
+argparser.add_argument(
+    '--chunk-size',
+    type=int,
+    default=DEFAULT_CHUNK_SIZE,
+    help='Number of lines sent to a worker process at a time (%d by default)' % DEFAULT_CHUNK_SIZE,
+)
+
+argparser.add_argument(
+    '--cache-size',
+    type=int,
+    default=0,
+    help='Number of distinct lines whose output is cached, useful for corpora with many repeated lines '
+         '(disabled by default)',
+)
+
+
+def categorize_chunk(lines):
+    return [thot_preproc.categorize(line) for line in lines]
+
 
 def main():
     cli_args = argparser.parse_args()
@@ -36,7 +66,14 @@ def main():
     else:
         fd = io.open(cli_args.file, 'r', encoding='utf-8')
 
+    cache = LRUCache(cli_args.cache_size) if cli_args.cache_size > 0 else None
+
     with FileInput(fd) as f:
-        for line in f:
-            categorized_line = thot_preproc.categorize(line)
+        categorized_lines = parallel_map_chunks(
+            categorize_chunk, f, jobs=cli_args.jobs, chunk_size=cli_args.chunk_size, cache=cache,
+        )
+        for categorized_line in categorized_lines:
             print(categorized_line.encode('utf-8'))
+
+    if cache is not None:
+        print("Line cache:", cache.stats(), file=sys.stderr)
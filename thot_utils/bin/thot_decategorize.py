@@ -5,11 +5,10 @@ Some description
 """
 import argparse
 import io
-import itertools
-
-import nltk
 
 from thot_utils.libs import thot_preproc
+from thot_utils.libs.parallel import DEFAULT_CHUNK_SIZE
+from thot_utils.libs.parallel import parallel_map_chunks
 
 argparser = argparse.ArgumentParser(description=__doc__)
 argparser.add_argument(
@@ -30,12 +29,31 @@ argparser.add_argument(
 argparser.add_argument(
     '-i',
     '--hypothesis-file',
+    type=str,
+    help='File with the hypotheses of the decoder including their alignment information',
+    required=True,
+)
+
+argparser.add_argument(
+    '-j',
+    '--jobs',
     type=int,
-    help='Minimum sentence length (1 by default)',
     default=1,
+    help='Number of worker processes (1 by default)',
+)
+
+argparser.add_argument(
+    '--chunk-size',
+    type=int,
+    default=DEFAULT_CHUNK_SIZE,
+    help='Number of lines sent to a worker process at a time (%d by default)' % DEFAULT_CHUNK_SIZE,
 )
 
 
+def decategorize_chunk(triplets):
+    return [thot_preproc.decategorize(sline, tline, iline) for sline, tline, iline in triplets]
+
+
 def main():
     cli_args = argparser.parse_args()
 
@@ -43,17 +61,16 @@ def main():
     tfile = io.open(cli_args.target_file, 'r', encoding='utf-8')
     ifile = io.open(cli_args.hypothesis_file, 'r', encoding='utf-8')
 
-    for sline, tline, iline in zip(sfile, tfile, ifile):
-        # Read source, target and hypothesis information
-        sline = sline.strip('\n')
-        tline = tline.strip('\n')
-        iline = iline.strip('\n')
-
-        decategorized_line = thot_preproc.decategorize(sline, tline, iline)
+    # Read source, target and hypothesis information
+    triplets = (
+        (sline.strip('\n'), tline.strip('\n'), iline.strip('\n')) for sline, tline, iline in zip(sfile, tfile, ifile)
+    )
+    decategorized_lines = parallel_map_chunks(
+        decategorize_chunk, triplets, jobs=cli_args.jobs, chunk_size=cli_args.chunk_size,
+    )
+    for decategorized_line in decategorized_lines:
         print(decategorized_line.encode('utf-8'))
 
 
 if __name__ == '__main__':
     main()
-
-nltk.word_tokenize('aa aa')
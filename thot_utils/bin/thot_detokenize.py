@@ -7,10 +7,15 @@ import argparse
 import codecs
 import io
 import sys
+import time
 
+from thot_utils.libs import config
 from thot_utils.libs import detokenize
 from thot_utils.libs import thot_preproc
 from thot_utils.libs.file_input import FileInput
+from thot_utils.libs.utils import MemoryBudget
+from thot_utils.libs.utils import non_negative_float
+from thot_utils.libs.utils import positive_int
 
 argparser = argparse.ArgumentParser(description=__doc__)
 
@@ -37,6 +42,83 @@ mutex_group.add_argument(
     help='Read model from standard input',
 )
 
+argparser.add_argument(
+    '--search',
+    choices=thot_preproc.SEARCH_ALGORITHMS,
+    default='best-first',
+    help='Search algorithm of the decoder, viterbi performs an exhaustive monotone search with bounded work '
+         'and beam prunes it using --beam-width and --beam-threshold (best-first by default)',
+)
+
+argparser.add_argument(
+    '--beam-width',
+    type=positive_int,
+    default=thot_preproc.DEFAULT_BEAM_WIDTH,
+    help='Maximum number of hypotheses expanded per source position with beam search (%d by default)' %
+         thot_preproc.DEFAULT_BEAM_WIDTH,
+)
+
+argparser.add_argument(
+    '--beam-threshold',
+    type=non_negative_float,
+    default=None,
+    help='Maximum log-probability difference with the best hypothesis of a source position for a hypothesis '
+         'to be expanded with beam search (disabled by default)',
+)
+
+argparser.add_argument(
+    '--no-future-cost',
+    action='store_true',
+    help='Order the hypotheses of the best-first search by their score only, without adding an estimation of '
+         'the score of the words they do not cover yet',
+)
+
+argparser.add_argument(
+    '--phrase-trie',
+    action='store_true',
+    help='Only look up in the translation model the spans of up to %d words that are sources of it, according to '
+         'a prefix tree of all the sources built in memory when the models are loaded (disabled by default). '
+         'The multi-word spans looked up are then known to be sources, so the Bloom filter of the model file only '
+         'rejects unknown words' % config.a_par,
+)
+
+argparser.add_argument(
+    '--lm-cache-size',
+    type=int,
+    default=thot_preproc.DEFAULT_LM_CACHE_SIZE,
+    help='Number of language model scores cached across sentences, 0 disables the cache (%d by default)' %
+         thot_preproc.DEFAULT_LM_CACHE_SIZE,
+)
+
+argparser.add_argument(
+    '--tm-cache-size',
+    type=int,
+    default=thot_preproc.DEFAULT_TM_CACHE_SIZE,
+    help='Number of source phrases whose translation options are cached across sentences, 0 disables the cache '
+         '(%d by default)' % thot_preproc.DEFAULT_TM_CACHE_SIZE,
+)
+
+argparser.add_argument(
+    '--preload',
+    action='store_true',
+    help='Read the model tables into memory before processing the text instead of querying sqlite for every '
+         'lookup, the models exceeding --preload-max-mb are still read from sqlite',
+)
+
+argparser.add_argument(
+    '--preload-max-mb',
+    type=int,
+    default=thot_preproc.DEFAULT_PRELOAD_MAX_MB,
+    help='Approximate maximum memory used by the preloaded models in MB (%d by default)' %
+         thot_preproc.DEFAULT_PRELOAD_MAX_MB,
+)
+
+argparser.add_argument(
+    '--stats',
+    action='store_true',
+    help='Print decoder statistics to the standard error when finished',
+)
+
 
 def main():
     cli_args = argparser.parse_args()
@@ -47,10 +129,27 @@ def main():
         model_provider=db_translation_model_provider
     )
     db_language_model_provider = detokenize.LanguageModelDBProvider(cli_args.sqlite)
+
+    if cli_args.preload:
+        start = time.time()
+        budget = MemoryBudget(cli_args.preload_max_mb * 1024 * 1024)
+        providers = (('translation', db_translation_model_provider), ('language', db_language_model_provider))
+        for model, provider in providers:
+            if not provider.preload(budget):
+                print("Warning: the %s model exceeds the preload memory limit, it will be read from sqlite" % model,
+                      file=sys.stderr)
+        print("Models preloaded in %.2f seconds, %.1f MB" % (time.time() - start, budget.size / 1024.0 / 1024.0),
+              file=sys.stderr)
+
     lmodel = thot_preproc.LangModel(db_language_model_provider, ngrams_length=2)
 
     weights = [1, 0, 0, 1]
-    decoder = thot_preproc.Decoder(tmodel, lmodel, weights)
+    decoder = thot_preproc.Decoder(
+        tmodel, lmodel, weights, search=cli_args.search, beam_width=cli_args.beam_width,
+        beam_threshold=cli_args.beam_threshold, lm_cache_size=cli_args.lm_cache_size,
+        tm_cache_size=cli_args.tm_cache_size, future_cost=not cli_args.no_future_cost,
+        phrase_trie=cli_args.phrase_trie,
+    )
 
     if cli_args.stdin:
         fd = codecs.getreader('utf-8')(sys.stdin)
@@ -61,5 +160,10 @@ def main():
         for line in f:
             print(decoder.detokenize(line).encode('utf-8'))
 
+    if cli_args.stats:
+        for line in decoder.stats():
+            print(line, file=sys.stderr)
+
+
 if __name__ == "__main__":
     main()
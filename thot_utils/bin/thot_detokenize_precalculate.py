@@ -3,6 +3,7 @@
 import argparse
 import io
 
+from thot_utils.libs import config
 from thot_utils.libs import detokenize
 
 argparser = argparse.ArgumentParser(description=__doc__)
@@ -31,6 +32,13 @@ argparser.add_argument(
     required=True,
 )
 
+argparser.add_argument(
+    '--logprobs',
+    action='store_true',
+    help='Also store the interpolated language model logprobs, so that they are looked up instead of being '
+         'computed from the n-gram counts.',
+)
+
 
 ##################################################
 def main():
@@ -51,6 +59,10 @@ def main():
     )
     db_language_model_provider = detokenize.LanguageModelDBProvider(cli_args.output)
     db_language_model_provider.load_from_other_provider(language_model_provider)
+    if cli_args.logprobs:
+        db_language_model_provider.load_logprobs_from_other_provider(
+            language_model_provider, ngrams_length=2, interp_prob=config.lm_interp_prob
+        )
 
 
 if __name__ == "__main__":
@@ -10,6 +10,8 @@ import sys
 
 from thot_utils.libs import thot_preproc
 from thot_utils.libs.file_input import FileInput
+from thot_utils.libs.parallel import parallel_map_chunks
+from thot_utils.libs.utils import LRUCache
 
 argparser = argparse.ArgumentParser(description=__doc__)
 mutex_group = argparser.add_mutually_exclusive_group(required=True)
@@ -27,6 +29,18 @@ mutex_group.add_argument(
     help='Read model from standard input',
 )
 
+argparser.add_argument(
+    '--cache-size',
+    type=int,
+    default=0,
+    help='Number of distinct lines whose output is cached, useful for corpora with many repeated lines '
+         '(disabled by default)',
+)
+
+
+def lowercase_chunk(lines):
+    return [thot_preproc.lowercase(line) for line in lines]
+
 
 def main():
     cli_args = argparser.parse_args()
@@ -35,12 +49,16 @@ def main():
     else:
         fd = io.open(cli_args.file, 'r', encoding='utf-8')
 
+    cache = LRUCache(cli_args.cache_size) if cli_args.cache_size > 0 else None
+
     with FileInput(fd) as f:
-        for line in f:
-            line = line.strip("\n")
-            line = thot_preproc.lowercase(line)
+        lines = (line.strip("\n") for line in f)
+        for line in parallel_map_chunks(lowercase_chunk, lines, cache=cache):
             print(line.encode("utf-8"))
 
+    if cache is not None:
+        print("Line cache:", cache.stats(), file=sys.stderr)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,126 @@
+# -*- coding:utf-8 -*-
+"""
+Runs several preprocessing stages (tokenize, lowercase, categorize) over
+each line in a single process, producing the same tokens as chaining
+thot_tokenize, thot_lowercase and thot_categorize
+"""
+import argparse
+import codecs
+import io
+import sys
+
+from thot_utils.libs import thot_preproc
+from thot_utils.libs.file_input import FileInput
+from thot_utils.libs.parallel import DEFAULT_CHUNK_SIZE
+from thot_utils.libs.parallel import parallel_map_chunks
+from thot_utils.libs.pipeline import STAGES
+from thot_utils.libs.pipeline import Pipeline
+from thot_utils.libs.pipeline import parse_stages
+from thot_utils.libs.utils import LRUCache
+
+argparser = argparse.ArgumentParser(description=__doc__)
+
+mutex_group = argparser.add_mutually_exclusive_group(required=True)
+mutex_group.add_argument(
+    '-f',
+    '--file',
+    type=str,
+    help='File with text to be processed (can be read from stdin)',
+)
+
+mutex_group.add_argument(
+    '-s',
+    '--stdin',
+    action='store_true',
+    help='Read model from standard input',
+)
+
+argparser.add_argument(
+    '--stages',
+    type=parse_stages,
+    default=list(STAGES),
+    help='Comma separated list of stages to run in order, among: %s (all of them by default)' % ','.join(STAGES),
+)
+
+argparser.add_argument(
+    '-a',
+    '--atoms-file',
+    type=str,
+    help='File with additional atoms (one per line) that must not be split into separate tokens',
+)
+
+argparser.add_argument(
+    '--atom-engine',
+    choices=thot_preproc.TOKENIZER_ENGINES,
+    default='regex',
+    help='Atom matching engine, "trie" is faster for long atom lists (regex by default)',
+)
+
+argparser.add_argument(
+    '-j',
+    '--jobs',
+    type=int,
+    default=1,
+    help='Number of worker processes (1 by default)',
+)
+
+argparser.add_argument(
+    '--chunk-size',
+    type=int,
+    default=DEFAULT_CHUNK_SIZE,
+    help='Number of lines sent to a worker process at a time (%d by default)' % DEFAULT_CHUNK_SIZE,
+)
+
+argparser.add_argument(
+    '--cache-size',
+    type=int,
+    default=0,
+    help='Number of distinct lines whose output is cached, useful for corpora with many repeated lines '
+         '(disabled by default)',
+)
+
+# Pipeline of the current (worker) process
+_pipeline = None
+
+
+def init_pipeline(stages, atoms, engine):
+    global _pipeline
+    _pipeline = Pipeline(stages, thot_preproc.get_tokenizer(atoms=atoms, engine=engine))
+
+
+def process_chunk(lines):
+    return [_pipeline.process(line) for line in lines]
+
+
+def main():
+    cli_args = argparser.parse_args()
+    unknown_stages = [stage for stage in cli_args.stages if stage not in STAGES]
+    if unknown_stages:
+        argparser.error('unknown stages: %s' % ','.join(unknown_stages))
+    atoms = None
+    if cli_args.atoms_file:
+        atoms = thot_preproc.default_atoms + thot_preproc.load_atoms(cli_args.atoms_file)
+
+    if cli_args.stdin:
+        fd = codecs.getreader('utf-8')(sys.stdin)
+    else:
+        fd = io.open(cli_args.file, 'r', encoding='utf-8')
+
+    cache = LRUCache(cli_args.cache_size) if cli_args.cache_size > 0 else None
+
+    with FileInput(fd) as f:
+        lines = (line.strip("\n") for line in f)
+        processed_lines = parallel_map_chunks(
+            process_chunk, lines, jobs=cli_args.jobs, chunk_size=cli_args.chunk_size,
+            initializer=init_pipeline, initargs=(cli_args.stages, atoms, cli_args.atom_engine),
+            cache=cache,
+        )
+        for processed_line in processed_lines:
+            print(processed_line.encode("utf-8"))
+
+    if cache is not None:
+        print("Line cache:", cache.stats(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ Some description
 import argparse
 import io
 
+from thot_utils.libs import config
 from thot_utils.libs import recase
 
 argparser = argparse.ArgumentParser(description=__doc__)
@@ -26,6 +27,13 @@ argparser.add_argument(
     required=True,
 )
 
+argparser.add_argument(
+    '--logprobs',
+    action='store_true',
+    help='Also store the interpolated language model logprobs, so that they are looked up instead of being '
+         'computed from the n-gram counts.',
+)
+
 
 def main():
     cli_args = argparser.parse_args()
@@ -39,6 +47,10 @@ def main():
     language_model_provider = recase.LanguageModelFileProvider(fd, ngrams_length=2)
     db_language_model_provider = recase.LanguageModelDBProvider(cli_args.output)
     db_language_model_provider.load_from_other_provider(language_model_provider)
+    if cli_args.logprobs:
+        db_language_model_provider.load_logprobs_from_other_provider(
+            language_model_provider, ngrams_length=2, interp_prob=config.lm_interp_prob
+        )
 
 
 if __name__ == "__main__":
@@ -10,6 +10,9 @@ import sys
 
 from thot_utils.libs import thot_preproc
 from thot_utils.libs.file_input import FileInput
+from thot_utils.libs.parallel import DEFAULT_CHUNK_SIZE
+from thot_utils.libs.parallel import parallel_map_chunks
+from thot_utils.libs.utils import LRUCache
 
 argparser = argparse.ArgumentParser(description=__doc__)
 
@@ -28,21 +31,96 @@ mutex_group.add_argument(
     help='Read model from standard input',
 )
 
+argparser.add_argument(
+    '-a',
+    '--atoms-file',
+    type=str,
+    help='File with additional atoms (one per line) that must not be split into separate tokens',
+)
+
+argparser.add_argument(
+    '--atom-engine',
+    choices=thot_preproc.TOKENIZER_ENGINES,
+    default='regex',
+    help='Atom matching engine, "trie" is faster for long atom lists (regex by default)',
+)
+
+argparser.add_argument(
+    '--spans',
+    action='store_true',
+    help='Print the start:end character offsets of the tokens in the line instead of the tokens',
+)
+
+argparser.add_argument(
+    '-j',
+    '--jobs',
+    type=int,
+    default=1,
+    help='Number of worker processes (1 by default)',
+)
+
+argparser.add_argument(
+    '--chunk-size',
+    type=int,
+    default=DEFAULT_CHUNK_SIZE,
+    help='Number of lines sent to a worker process at a time (%d by default)' % DEFAULT_CHUNK_SIZE,
+)
+
+argparser.add_argument(
+    '--cache-size',
+    type=int,
+    default=0,
+    help='Number of distinct lines whose output is cached, useful for corpora with many repeated lines '
+         '(disabled by default)',
+)
+
+# Tokenizer of the current (worker) process
+_tokenizer = None
+
+
+def init_tokenizer(atoms, engine):
+    global _tokenizer
+    _tokenizer = thot_preproc.get_tokenizer(atoms=atoms, engine=engine)
+
+
+def tokenize_chunk(lines):
+    return [u' '.join(tokens) for tokens in thot_preproc.tokenize_many(lines, _tokenizer)]
+
+
+def tokenize_spans_chunk(lines):
+    return [
+        u' '.join(u'%d:%d' % span for span in thot_preproc.tokenize_spans(line, _tokenizer))
+        for line in lines
+    ]
+
 
 def main():
     cli_args = argparser.parse_args()
+    atoms = None
+    if cli_args.atoms_file:
+        atoms = thot_preproc.default_atoms + thot_preproc.load_atoms(cli_args.atoms_file)
+
     if cli_args.stdin:
         fd = codecs.getreader('utf-8')(sys.stdin)
     else:
         fd = io.open(cli_args.file, 'r', encoding='utf-8')
 
+    cache = LRUCache(cli_args.cache_size) if cli_args.cache_size > 0 else None
+
     with FileInput(fd) as f:
-        for line in f:
-            line = line.strip("\n")
-            tokens = thot_preproc.tokenize(line)
-            tok_sent = u' '.join(tokens)
+        lines = (line.strip("\n") for line in f)
+        tok_sents = parallel_map_chunks(
+            tokenize_spans_chunk if cli_args.spans else tokenize_chunk, lines,
+            jobs=cli_args.jobs, chunk_size=cli_args.chunk_size,
+            initializer=init_tokenizer, initargs=(atoms, cli_args.atom_engine),
+            cache=cache,
+        )
+        for tok_sent in tok_sents:
             print(tok_sent.encode("utf-8"))
 
+    if cache is not None:
+        print("Line cache:", cache.stats(), file=sys.stderr)
+
 
 if __name__ == "__main__":
     main()
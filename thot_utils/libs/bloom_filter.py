@@ -0,0 +1,69 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import math
+import struct
+
+DEFAULT_ERROR_RATE = 0.01
+
+# Two 64 bits integers taken from an md5 digest
+_digest = struct.Struct(str('<QQ'))
+
+
+class BloomFilter(object):
+    """
+    Compact membership sketch of a set of strings.  It never misses a string
+    that was added, but it may report as present a string that was not (with
+    probability error_rate for the capacity it was sized for).
+    The positions of each string are obtained by double hashing its md5 digest.
+    """
+
+    def __init__(self, num_bits, num_hashes, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        if bits is None:
+            bits = bytearray((num_bits + 7) // 8)
+        self.bits = bytearray(bits)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=DEFAULT_ERROR_RATE):
+        """
+        returns an empty filter with the optimal size for capacity strings
+        """
+        capacity = max(capacity, 1)
+        num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        return cls(num_bits, num_hashes)
+
+    def hashes(self, item):
+        """
+        returns the first position of item and the step between its
+        positions (double hashing)
+        """
+        h1, h2 = _digest.unpack(hashlib.md5(item.encode('utf-8')).digest())
+        return h1 % self.num_bits, (h2 | 1) % self.num_bits
+
+    def add(self, item):
+        pos, step = self.hashes(item)
+        for _ in range(self.num_hashes):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+            pos = (pos + step) % self.num_bits
+
+    def __contains__(self, item):
+        # Most of the strings that were not added are rejected by one of the
+        # first positions
+        bits = self.bits
+        num_bits = self.num_bits
+        pos, step = self.hashes(item)
+        for _ in range(self.num_hashes):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+            pos = (pos + step) % num_bits
+        return True
+
+    def to_bytes(self):
+        return bytes(self.bits)
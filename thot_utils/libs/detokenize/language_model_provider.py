@@ -11,7 +11,9 @@ from collections import Counter
 from nltk import ngrams
 
 from thot_utils.libs import config
+from thot_utils.libs.math_functions import interp_ngram_logprobs
 from thot_utils.libs.utils import is_categ
+from thot_utils.libs.utils import preload_table
 from thot_utils.libs.utils import split_string_to_words
 from thot_utils.libs.utils import transform_word
 
@@ -27,6 +29,21 @@ class LanguageModelProviderInterface(object):
     def get_all_counts(self):
         pass
 
+    def get_logprob_params(self):
+        """
+        returns the parameters the precalculated logprobs were obtained with
+        (a dictionary with the interp_prob and ngrams_length keys), or None if
+        there are no precalculated logprobs
+        """
+        return None
+
+    def get_logprob(self, ngram):
+        """
+        returns the precalculated logprob of ngram, or None if it is not
+        stored
+        """
+        return None
+
 
 class LanguageModelFileProvider(LanguageModelProviderInterface):
     def __init__(self, raw_fd, tokenized_fd, ngrams_length):
@@ -55,6 +72,9 @@ class LanguageModelFileProvider(LanguageModelProviderInterface):
             prev_j = 0
             error = False
 
+            # Transform each tokenized word only once
+            trans_tok_array = [transform_word(tok) for tok in tok_array]
+
             # Obtain transformed raw word array
             trans_raw_word_array = []
             while (i < len(raw_word_array)):
@@ -79,13 +99,12 @@ class LanguageModelFileProvider(LanguageModelProviderInterface):
 
                 # update the language model
                 tm_entry_ok = True
-                tok_words = transform_word(tok_array[prev_j])
-                raw_word = transform_word(tok_array[prev_j])
+                tok_words = trans_tok_array[prev_j]
+                raw_word = trans_tok_array[prev_j]
                 for k in range(prev_j + 1, j):
-                    tok_words = tok_words + " " + transform_word(tok_array[k])
-                    raw_word = raw_word + transform_word(tok_array[k])
-                    if (is_categ(transform_word(tok_array[k - 1])) and
-                            is_categ(transform_word(tok_array[k]))):
+                    tok_words = tok_words + " " + trans_tok_array[k]
+                    raw_word = raw_word + trans_tok_array[k]
+                    if is_categ(trans_tok_array[k - 1]) and is_categ(trans_tok_array[k]):
                         tm_entry_ok = False
 
                 trans_raw_word_array.append(raw_word)
@@ -122,8 +141,33 @@ class LanguageModelDBProvider(LanguageModelProviderInterface):
     def __init__(self, filename):
         self.connection = sqlite3.connect(filename)
         self.cursor = self.connection.cursor()
+        # Tables read into memory by preload()
+        self.ngram_counts = None
+        self.ngram_logprobs = None
+
+    def preload(self, budget):
+        """
+        Reads the tables into memory if they fit in budget, a MemoryBudget,
+        so that lookups do not query sqlite
+        returns True if the tables were loaded
+        """
+        start_size = budget.size
+        ngram_counts = preload_table(self.connection, 'select n, c from detokenize_ngram_counts', budget)
+        ngram_logprobs = None
+        if ngram_counts is not None and self.get_logprob_params() is not None:
+            ngram_logprobs = preload_table(self.connection, 'select n, lp from detokenize_ngram_logprobs', budget)
+            if ngram_logprobs is None:
+                ngram_counts = None
+        if ngram_counts is None:
+            budget.size = start_size
+            return False
+        self.ngram_counts = ngram_counts
+        self.ngram_logprobs = ngram_logprobs
+        return True
 
     def get_count(self, word):
+        if self.ngram_counts is not None:
+            return self.ngram_counts.get(word, 0)
         self.cursor.execute('select c from detokenize_ngram_counts where n=? limit 1', [word])
         rows = self.cursor.fetchall()
         if rows:
@@ -133,9 +177,51 @@ class LanguageModelDBProvider(LanguageModelProviderInterface):
     def get_all_counts(self):
         raise NotImplemented()
 
+    def get_logprob_params(self):
+        self.cursor.execute("select name from sqlite_master where type='table' and name='detokenize_lm_params'")
+        if not self.cursor.fetchall():
+            return None
+        self.cursor.execute('select name, value from detokenize_lm_params')
+        params = dict(self.cursor.fetchall())
+        params['ngrams_length'] = int(params['ngrams_length'])
+        return params
+
+    def get_logprob(self, ngram):
+        if self.ngram_logprobs is not None:
+            return self.ngram_logprobs.get(ngram)
+        self.cursor.execute('select lp from detokenize_ngram_logprobs where n=? limit 1', [ngram])
+        rows = self.cursor.fetchall()
+        if rows:
+            return rows[0][0]
+        return None
+
     def load_from_other_provider(self, provider):
         self.connection.execute('DROP TABLE IF EXISTS detokenize_ngram_counts')
         self.connection.execute('CREATE TABLE detokenize_ngram_counts (n text primary key not null, c int not null)')
         for key, value in provider.get_all_counts():
             self.cursor.execute('insert into detokenize_ngram_counts values (?, ?)', [' '.join(key), value])
         self.connection.commit()
+
+    def load_logprobs_from_other_provider(self, provider, ngrams_length, interp_prob):
+        """
+        Stores the interpolated logprobs of the n-grams counted by provider,
+        so that LangModel obtains them with a single lookup
+        """
+        counts = dict((tuple(key), value) for key, value in provider.get_all_counts())
+        self.connection.execute('DROP TABLE IF EXISTS detokenize_ngram_logprobs')
+        self.connection.execute(
+            'CREATE TABLE detokenize_ngram_logprobs (n text primary key not null, lp real not null)'
+        )
+        self.connection.executemany(
+            'insert into detokenize_ngram_logprobs values (?, ?)',
+            ((' '.join(ngram), lp) for ngram, lp in interp_ngram_logprobs(counts, interp_prob).items())
+        )
+        self.connection.execute('DROP TABLE IF EXISTS detokenize_lm_params')
+        self.connection.execute(
+            'CREATE TABLE detokenize_lm_params (name text primary key not null, value real not null)'
+        )
+        self.connection.executemany(
+            'insert into detokenize_lm_params values (?, ?)',
+            [('interp_prob', interp_prob), ('ngrams_length', ngrams_length)]
+        )
+        self.connection.commit()
@@ -40,3 +40,31 @@ def compute_mean_stddev_per_length(pairs_list):
 
     # Return result
     return mean_per_length, stddev_per_length, samples_per_length
+
+
+def interp_ngram_logprobs(counts, interp_prob):
+    """
+    Given a dictionary with the counts of the n-grams (tuples of words, the
+    empty tuple being the count of words), returns a dictionary with the
+    logprob of the last word of each n-gram given the previous ones, linearly
+    interpolating the relative frequencies of all the orders:
+        p(w | h) = interp_prob * c(h w) / c(h) + (1 - interp_prob) * p(w | h')
+    where h' is h without its oldest word and p(w | ()) = 1 / c(()).
+    The probability of an n-gram missing from the result is (1 - interp_prob)
+    times the probability of the n-gram without its oldest word.
+    """
+    probs = {(): 1.0 / counts[()]}
+
+    def interp_prob_of(ngram):
+        prob = probs.get(ngram)
+        if prob is None:
+            hc = counts.get(ngram[:-1], 0)
+            rel_freq = counts.get(ngram, 0) / hc if hc != 0 else 0
+            prob = probs[ngram] = interp_prob * rel_freq + (1 - interp_prob) * interp_prob_of(ngram[1:])
+        return prob
+
+    logprobs = {}
+    for ngram, count in counts.items():
+        if count > 0:
+            logprobs[ngram] = math.log(interp_prob_of(ngram))
+    return logprobs
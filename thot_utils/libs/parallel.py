@@ -0,0 +1,176 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import multiprocessing
+from collections import deque
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class _ReadyResult(object):
+    """
+    Result of a chunk processed in the current process, it mimics the
+    interface of multiprocessing's AsyncResult
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def iter_chunks(iterable, chunk_size):
+    """
+    Splits iterable into lists of at most chunk_size items
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _Pending(object):
+    """
+    Position of a chunk whose item was not found in the cache, its result
+    is computed by this chunk or by an earlier one still being processed
+    """
+    __slots__ = ('item',)
+
+    def __init__(self, item):
+        self.item = item
+
+
+class _CachedChunks(object):
+    """
+    Splits each chunk between cache hits and misses.  Only the unique
+    misses that are not already being computed for an earlier chunk are
+    submitted, their results are shared by all the chunks containing them
+    until the last of those chunks is collected.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        # Items being computed -> number of pending chunks containing them
+        self.refs = {}
+        # Results of the items being computed, once their chunk is collected
+        self.results = {}
+
+    def split(self, chunk):
+        """
+        returns the list of items to be computed and the list of results of
+        the chunk, where the items not found in the cache are _Pending
+        """
+        misses = []
+        slots = []
+        referenced = set()
+        for item in chunk:
+            result = self.cache.get(item, _Pending)
+            if result is not _Pending:
+                slots.append(result)
+                continue
+            if item not in self.refs and item not in referenced:
+                misses.append(item)
+            slots.append(_Pending(item))
+            referenced.add(item)
+        for item in referenced:
+            self.refs[item] = self.refs.get(item, 0) + 1
+        return misses, slots
+
+    def merge(self, misses, slots, results):
+        """
+        returns the results of a chunk given the results of its misses
+        """
+        for item, result in zip(misses, results):
+            self.cache.put(item, result)
+            self.results[item] = result
+        merged = []
+        referenced = set()
+        for slot in slots:
+            if isinstance(slot, _Pending):
+                merged.append(self.results[slot.item])
+                referenced.add(slot.item)
+            else:
+                merged.append(slot)
+        for item in referenced:
+            self.refs[item] -= 1
+            if self.refs[item] == 0:
+                del self.refs[item]
+                del self.results[item]
+        return merged
+
+
+def parallel_map_chunks(func, iterable, jobs=1, chunk_size=DEFAULT_CHUNK_SIZE, initializer=None, initargs=(),
+                        cache=None):
+    """
+    Splits iterable into chunks, applies func to each of them and yields the
+    results of the items in input order.  func receives a list of items and
+    must return the list of their results.
+
+    With jobs > 1 the chunks are processed by a pool of worker processes,
+    each of them initialized once with initializer(*initargs), so func and
+    initializer must be module-level functions.  At most two chunks per
+    worker are in flight, so memory use does not depend on the input size.
+
+    If an LRUCache is given, items are looked up in it before being sent
+    to func and only the misses are processed, each of them once even if it
+    is repeated in the chunks being processed.
+    """
+    if jobs <= 1:
+        # Items are processed one at a time, so that each result is yielded
+        # as soon as its item is read
+        pool = None
+        if initializer is not None:
+            initializer(*initargs)
+        chunk_size = 1
+        max_pending = 1
+    else:
+        pool = multiprocessing.Pool(jobs, initializer, initargs)
+        max_pending = 2 * jobs
+
+    def submit(chunk):
+        if not chunk:
+            return _ReadyResult([])
+        elif pool is None:
+            return _ReadyResult(func(chunk))
+        else:
+            return pool.apply_async(func, (chunk,))
+
+    cached_chunks = _CachedChunks(cache) if cache is not None else None
+
+    def collect(pending_chunk):
+        misses, slots, async_result = pending_chunk
+        if slots is None:
+            return async_result.get()
+        return cached_chunks.merge(misses, slots, async_result.get())
+
+    try:
+        pending = deque()
+        for chunk in iter_chunks(iterable, chunk_size):
+            if cached_chunks is None:
+                pending.append((chunk, None, submit(chunk)))
+            else:
+                misses, slots = cached_chunks.split(chunk)
+                pending.append((misses, slots, submit(misses)))
+            if len(pending) >= max_pending:
+                for result in collect(pending.popleft()):
+                    yield result
+        while pending:
+            for result in collect(pending.popleft()):
+                yield result
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    else:
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.join()
@@ -0,0 +1,47 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from thot_utils.libs import thot_preproc
+
+STAGES = ('tokenize', 'lowercase', 'categorize')
+
+
+class Pipeline(object):
+    """
+    Runs several preprocessing stages over a line in a single pass.
+    The XML annotations of the line are parsed once and the stages exchange
+    skeletons of (is_tag, tokens) pairs instead of strings.  The output has
+    the same tokens as chaining the single stage tools (thot_tokenize,
+    thot_lowercase, thot_categorize), the only difference being that
+    adjacent annotations are always separated by a single space.
+    """
+
+    def __init__(self, stages, tokenizer=None):
+        for stage in stages:
+            if stage not in STAGES:
+                raise ValueError("Unknown pipeline stage: %s" % stage)
+        self.stages = list(stages)
+        self.tokenizer = tokenizer if tokenizer is not None else thot_preproc.get_tokenizer()
+
+    def process_skeleton(self, skeleton):
+        for stage in self.stages:
+            if stage == 'tokenize':
+                skeleton = thot_preproc.tokenize_xml_skeleton(skeleton, self.tokenizer)
+            elif stage == 'lowercase':
+                skeleton = thot_preproc.lowercase_xml_skeleton(skeleton)
+            elif stage == 'categorize':
+                skeleton = thot_preproc.categorize_xml_skeleton(skeleton)
+        return skeleton
+
+    def process(self, line):
+        skeleton = thot_preproc.annotated_string_to_token_skeleton(line)
+        return u' '.join(thot_preproc.xml_skeleton_to_tokens(self.process_skeleton(skeleton)))
+
+
+def parse_stages(spec):
+    """
+    Parses a comma separated list of stages, e.g. 'tokenize,lowercase'
+    """
+    return [stage.strip() for stage in spec.split(',') if stage.strip()]
@@ -10,6 +10,8 @@ from collections import Counter
 from nltk import ngrams
 
 from thot_utils.libs import config
+from thot_utils.libs.math_functions import interp_ngram_logprobs
+from thot_utils.libs.utils import preload_table
 from thot_utils.libs.utils import split_string_to_words
 
 
@@ -24,6 +26,21 @@ class LanguageModelProviderInterface(object):
     def get_all_counts(self):
         pass
 
+    def get_logprob_params(self):
+        """
+        returns the parameters the precalculated logprobs were obtained with
+        (a dictionary with the interp_prob and ngrams_length keys), or None if
+        there are no precalculated logprobs
+        """
+        return None
+
+    def get_logprob(self, ngram):
+        """
+        returns the precalculated logprob of ngram, or None if it is not
+        stored
+        """
+        return None
+
 
 class LanguageModelFileProvider(LanguageModelProviderInterface):
     def __init__(self, fd, ngrams_length):
@@ -60,8 +77,33 @@ class LanguageModelDBProvider(LanguageModelProviderInterface):
     def __init__(self, filename):
         self.connection = sqlite3.connect(filename)
         self.cursor = self.connection.cursor()
+        # Tables read into memory by preload()
+        self.ngram_counts = None
+        self.ngram_logprobs = None
+
+    def preload(self, budget):
+        """
+        Reads the tables into memory if they fit in budget, a MemoryBudget,
+        so that lookups do not query sqlite
+        returns True if the tables were loaded
+        """
+        start_size = budget.size
+        ngram_counts = preload_table(self.connection, 'select n, c from ngram_counts', budget)
+        ngram_logprobs = None
+        if ngram_counts is not None and self.get_logprob_params() is not None:
+            ngram_logprobs = preload_table(self.connection, 'select n, lp from ngram_logprobs', budget)
+            if ngram_logprobs is None:
+                ngram_counts = None
+        if ngram_counts is None:
+            budget.size = start_size
+            return False
+        self.ngram_counts = ngram_counts
+        self.ngram_logprobs = ngram_logprobs
+        return True
 
     def get_count(self, word):
+        if self.ngram_counts is not None:
+            return self.ngram_counts.get(word, 0)
         self.cursor.execute('select c from ngram_counts where n=? limit 1', [word])
         rows = self.cursor.fetchall()
         if rows:
@@ -71,8 +113,46 @@ class LanguageModelDBProvider(LanguageModelProviderInterface):
     def get_all_counts(self):
         raise NotImplemented()
 
+    def get_logprob_params(self):
+        self.cursor.execute("select name from sqlite_master where type='table' and name='lm_params'")
+        if not self.cursor.fetchall():
+            return None
+        self.cursor.execute('select name, value from lm_params')
+        params = dict(self.cursor.fetchall())
+        params['ngrams_length'] = int(params['ngrams_length'])
+        return params
+
+    def get_logprob(self, ngram):
+        if self.ngram_logprobs is not None:
+            return self.ngram_logprobs.get(ngram)
+        self.cursor.execute('select lp from ngram_logprobs where n=? limit 1', [ngram])
+        rows = self.cursor.fetchall()
+        if rows:
+            return rows[0][0]
+        return None
+
     def load_from_other_provider(self, provider):
         self.connection.execute('CREATE TABLE ngram_counts (n text primary key not null, c int not null)')
         for key, value in provider.get_all_counts():
             self.cursor.execute('insert into ngram_counts values (?, ?)', [' '.join(key), value])
         self.connection.commit()
+
+    def load_logprobs_from_other_provider(self, provider, ngrams_length, interp_prob):
+        """
+        Stores the interpolated logprobs of the n-grams counted by provider,
+        so that LangModel obtains them with a single lookup
+        """
+        counts = dict((tuple(key), value) for key, value in provider.get_all_counts())
+        self.connection.execute('DROP TABLE IF EXISTS ngram_logprobs')
+        self.connection.execute('CREATE TABLE ngram_logprobs (n text primary key not null, lp real not null)')
+        self.connection.executemany(
+            'insert into ngram_logprobs values (?, ?)',
+            ((' '.join(ngram), lp) for ngram, lp in interp_ngram_logprobs(counts, interp_prob).items())
+        )
+        self.connection.execute('DROP TABLE IF EXISTS lm_params')
+        self.connection.execute('CREATE TABLE lm_params (name text primary key not null, value real not null)')
+        self.connection.executemany(
+            'insert into lm_params values (?, ?)',
+            [('interp_prob', interp_prob), ('ngrams_length', ngrams_length)]
+        )
+        self.connection.commit()
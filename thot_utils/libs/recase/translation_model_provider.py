@@ -5,11 +5,18 @@ from __future__ import unicode_literals
 
 import abc
 import sqlite3
+from collections import Counter
 from collections import defaultdict
 
+from thot_utils.libs.bloom_filter import BloomFilter
 from thot_utils.libs.thot_preproc import lowercase
+from thot_utils.libs.utils import preload_table
 from thot_utils.libs.utils import split_string_to_words
 
+# Maximum number of sources looked up in a single query, sqlite limits the
+# number of parameters of a statement
+SQLITE_BATCH_SIZE = 500
+
 
 class TranslationModelProviderInterface(object):
     __metaclass__ = abc.ABCMeta
@@ -30,10 +37,36 @@ class TranslationModelProviderInterface(object):
     def get_all_source_counts(self):
         pass
 
+    def get_options(self, src):
+        """
+        returns a pair (source count, list of (target, count) pairs)
+        """
+        return self.get_source_count(src), [(trg, self.get_target_count(src, trg)) for trg in self.get_targets(src)]
+
+    def get_options_batch(self, srcs):
+        """
+        returns a dictionary mapping each of the given sources to a pair
+        (source count, list of (target, count) pairs)
+        """
+        return dict((src, self.get_options(src)) for src in set(srcs))
+
     @abc.abstractmethod
     def get_all_target_counts(self):
         pass
 
+    def get_sources(self):
+        """
+        returns an iterator over the sources of the model
+        """
+        for src, _ in self.get_all_source_counts():
+            yield src
+
+    def stats(self):
+        """
+        returns a list of lines with statistics about the lookups
+        """
+        return []
+
 
 class TranslationModelFileProvider(TranslationModelProviderInterface):
     def __init__(self, fd):
@@ -66,6 +99,13 @@ class TranslationModelFileProvider(TranslationModelProviderInterface):
     def get_source_count(self, src_words):
         return self.s_counts[src_words]
 
+    def get_options(self, src):
+        targets = self.st_counts.get(src)
+        return self.s_counts.get(src, 0), list(targets.items()) if targets else []
+
+    def get_options_batch(self, srcs):
+        return dict((src, self.get_options(src)) for src in srcs)
+
     def get_all_source_counts(self):
         for source, count in self.s_counts.items():
             yield source, count
@@ -80,12 +120,82 @@ class TranslationModelDBProvider(TranslationModelProviderInterface):
     def __init__(self, filename):
         self.connection = sqlite3.connect(filename)
         self.cursor = self.connection.cursor()
+        # Tables read into memory by preload()
+        self.s_counts = None
+        self.st_counts = None
+        self.bloom_filter = self.load_bloom_filter()
+        self.counters = Counter()
+
+    def load_bloom_filter(self):
+        """
+        returns the Bloom filter of the sources stored with the tables, or
+        None if there is none
+        """
+        self.cursor.execute("select name from sqlite_master where type='table' and name='source_bloom_filter'")
+        if not self.cursor.fetchall():
+            return None
+        self.cursor.execute('select num_bits, num_hashes, bits from source_bloom_filter limit 1')
+        num_bits, num_hashes, bits = self.cursor.fetchone()
+        return BloomFilter(num_bits, num_hashes, bits)
+
+    def source_may_exist(self, src):
+        """
+        returns False if the Bloom filter tells that src is not a source of
+        the model, so that it does not need to be looked up in sqlite
+        """
+        if self.bloom_filter is None:
+            return True
+        self.counters['bloom filter lookups'] += 1
+        if src in self.bloom_filter:
+            return True
+        self.counters['bloom filter rejections'] += 1
+        return False
+
+    def stats(self):
+        if self.bloom_filter is None:
+            return []
+        return ["Bloom filter: %d of %d source lookups short-circuited" % (
+            self.counters['bloom filter rejections'], self.counters['bloom filter lookups']
+        )]
+
+    def preload(self, budget):
+        """
+        Reads the tables into memory if they fit in budget, a MemoryBudget,
+        so that lookups do not query sqlite
+        returns True if the tables were loaded
+        """
+        start_size = budget.size
+        s_counts = preload_table(self.connection, 'select t, c from s_counts', budget)
+        st_counts = {}
+        if s_counts is not None:
+            for src, trg, count in self.connection.execute('select s, t, c from st_counts'):
+                targets = st_counts.get(src)
+                if targets is None:
+                    targets = st_counts[src] = {}
+                targets[trg] = count
+                if not budget.charge(trg, count):
+                    s_counts = None
+                    break
+        if s_counts is None:
+            budget.size = start_size
+            return False
+        self.s_counts = s_counts
+        self.st_counts = st_counts
+        return True
 
     def get_targets(self, src_word):
+        if self.st_counts is not None:
+            return list(self.st_counts.get(src_word, {}))
+        if not self.source_may_exist(src_word):
+            return []
         self.cursor.execute('select t from st_counts where s=?', [src_word])
         return [t for t, in self.cursor.fetchall()]
 
     def get_target_count(self, src_words, trg_words):
+        if self.st_counts is not None:
+            return self.st_counts.get(src_words, {}).get(trg_words, 0)
+        if not self.source_may_exist(src_words):
+            return 0
         self.cursor.execute('select c from st_counts where s=? and t=? limit 1', [src_words, trg_words])
         rows = self.cursor.fetchall()
         if rows:
@@ -93,12 +203,53 @@ class TranslationModelDBProvider(TranslationModelProviderInterface):
         return 0
 
     def get_source_count(self, src_words):
+        if self.s_counts is not None:
+            return self.s_counts.get(src_words, 0)
+        if not self.source_may_exist(src_words):
+            return 0
         self.cursor.execute('select c from s_counts where t=? limit 1', [src_words])
         rows = self.cursor.fetchall()
         if rows:
             return rows[0][0]
         return 0
 
+    def get_sources(self):
+        if self.s_counts is not None:
+            return iter(self.s_counts)
+        return (src for src, in self.connection.execute('select t from s_counts'))
+
+    def get_options(self, src):
+        if self.st_counts is not None:
+            return self.s_counts.get(src, 0), list(self.st_counts.get(src, {}).items())
+        if not self.source_may_exist(src):
+            return 0, []
+        self.cursor.execute(
+            'select s.c, st.t, st.c from s_counts s left join st_counts st on st.s = s.t where s.t = ?', [src]
+        )
+        rows = self.cursor.fetchall()
+        if not rows:
+            return 0, []
+        return rows[0][0], [(trg, count) for _, trg, count in rows if trg is not None]
+
+    def get_options_batch(self, srcs):
+        if self.st_counts is not None:
+            return dict((src, self.get_options(src)) for src in srcs)
+        options = dict((src, (0, [])) for src in srcs)
+        srcs = [src for src in options if self.source_may_exist(src)]
+        for i in range(0, len(srcs), SQLITE_BATCH_SIZE):
+            batch = srcs[i:i + SQLITE_BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            self.cursor.execute(
+                'select s.t, s.c, st.t, st.c from s_counts s left join st_counts st on st.s = s.t '
+                'where s.t in (%s)' % placeholders, batch
+            )
+            for src, src_count, trg, count in self.cursor.fetchall():
+                targets = options[src][1]
+                options[src] = (src_count, targets)
+                if trg is not None:
+                    targets.append((trg, count))
+        return options
+
     def get_all_source_counts(self):
         raise NotImplemented()
 
@@ -107,12 +258,33 @@ class TranslationModelDBProvider(TranslationModelProviderInterface):
 
     def load_from_other_provider(self, provider):
         self.connection.execute('CREATE TABLE s_counts (t text primary key not null, c int not null)')
+        sources = []
         for key, value in provider.get_all_source_counts():
             self.cursor.execute('insert into s_counts values (?, ?)', [key, value])
+            sources.append(key)
         self.connection.commit()
+        self.store_bloom_filter(sources)
 
         self.connection.execute(
             'CREATE TABLE st_counts (s text not null, t text not null, c int not null, PRIMARY KEY(s, t))')
         for source, target, count in provider.get_all_target_counts():
             self.cursor.execute('insert into st_counts values (?, ?, ?)', [source, target, count])
         self.connection.commit()
+
+    def store_bloom_filter(self, sources):
+        """
+        Stores a Bloom filter of the given sources, consulted before
+        looking up a source in sqlite
+        """
+        bloom_filter = BloomFilter.for_capacity(len(sources))
+        for src in sources:
+            bloom_filter.add(src)
+        self.connection.execute(
+            'CREATE TABLE source_bloom_filter (num_bits int not null, num_hashes int not null, bits blob not null)'
+        )
+        self.connection.execute(
+            'insert into source_bloom_filter values (?, ?, ?)',
+            [bloom_filter.num_bits, bloom_filter.num_hashes, sqlite3.Binary(bloom_filter.to_bytes())]
+        )
+        self.connection.commit()
+        self.bloom_filter = bloom_filter
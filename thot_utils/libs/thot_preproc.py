@@ -5,16 +5,22 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import io
 import math
+import operator
 import re
 import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
 from heapq import heappop
 from heapq import heappush
 
 from thot_utils.libs import config
-from thot_utils.libs.utils import is_alnum
+from thot_utils.libs.trie import Trie
+from thot_utils.libs.utils import LRUCache
+from thot_utils.libs.utils import classify_word
 from thot_utils.libs.utils import is_categ
-from thot_utils.libs.utils import is_number
 from thot_utils.libs.utils import split_string_to_words
 from thot_utils.libs.utils import transform_word
 
@@ -26,6 +32,15 @@ class TransModel(object):
     def obtain_opts_for_src(self, src_words):
         return self.model_provider.get_targets(src_words)
 
+    def obtain_source_trie(self):
+        """
+        returns a Trie with the words of the sources of the model
+        """
+        return Trie(src.split(u" ") for src in self.model_provider.get_sources())
+
+    def obtain_opts_batch(self, srcs):
+        return self.model_provider.get_options_batch(srcs)
+
     def obtain_srctrg_count(self, src_words, trg_words):
         return self.model_provider.get_target_count(src_words, trg_words)
 
@@ -43,22 +58,30 @@ class TransModel(object):
             return config.tm_smooth_prob
         else:
             stc = self.obtain_srctrg_count(src_words, trg_words)
+            return self.smoothed_prob(sc, stc)
+
+    def smoothed_prob(self, sc, stc):
+        if sc == 0:
+            return config.tm_smooth_prob
+        else:
             return (1 - config.tm_smooth_prob) * (float(stc) / float(sc))
 
     def obtain_src_count(self, src_words):
         return self.model_provider.get_source_count(src_words)
 
-    def get_mon_hyp_state(self, hyp):
-        if len(hyp.data.coverage) == 0:
-            return 0
-        else:
-            return hyp.data.coverage[len(hyp.data.coverage) - 1]
+    def stats(self):
+        # Providers not implementing stats() do not report anything
+        stats = getattr(self.model_provider, 'stats', None)
+        return stats() if stats is not None else []
 
 
 class LangModel:
     def __init__(self, provider, ngrams_length, interp_prob=None):
         self.provider = provider
         self.ngrams_length = ngrams_length
+        # Providers not implementing the logprob methods only have counts
+        get_logprob_params = getattr(provider, 'get_logprob_params', None)
+        self.logprob_params = get_logprob_params() if get_logprob_params is not None else None
         self.set_interp_prob(interp_prob or config.lm_interp_prob)
 
     def set_interp_prob(self, interp_prob):
@@ -69,6 +92,19 @@ class LangModel:
         else:
             self.interp_prob = interp_prob
 
+        # Precalculated logprobs can only be used if they were obtained with
+        # the same parameters
+        self.use_logprobs = False
+        if self.logprob_params is not None:
+            if self.logprob_params == {'interp_prob': self.interp_prob, 'ngrams_length': self.ngrams_length}:
+                self.use_logprobs = True
+                self.backoff_lp = math.log(1 - self.interp_prob)
+            else:
+                print(
+                    "Warning: the precalculated language model logprobs were obtained with different parameters,",
+                    "they will not be used", file=sys.stderr
+                )
+
     def obtain_ng_count(self, ngram):
         return self.provider.get_count(ngram)
 
@@ -93,6 +129,26 @@ class LangModel:
                 (1 - self.interp_prob) * self.obtain_trgsrc_interp_prob(self.remove_oldest_word(ngram))
             )
 
+    def obtain_trgsrc_interp_logprob(self, ngram):
+        """
+        returns the log of obtain_trgsrc_interp_prob(ngram).  With
+        precalculated logprobs, seen n-grams are answered with a single
+        lookup and unseen ones back off to the n-gram without its oldest
+        word
+        """
+        if not self.use_logprobs:
+            return math.log(self.obtain_trgsrc_interp_prob(ngram))
+
+        ng_array = ngram.split()
+        lp = 0
+        while ng_array:
+            ngram_lp = self.provider.get_logprob(u" ".join(ng_array))
+            if ngram_lp is not None:
+                return lp + ngram_lp
+            lp += self.backoff_lp
+            ng_array = ng_array[1:]
+        return lp + self.provider.get_logprob("")
+
     def remove_newest_word(self, ngram):
         ng_array = ngram.split()
         if len(ng_array) <= 1:
@@ -137,31 +193,68 @@ class LangModel:
                     hist = word + " " + hist
         return hist
 
-    def get_hyp_state(self, hyp):
-        return self.get_lm_state(hyp.data.words)
+    def extend_lm_state(self, state, words):
+        """
+        returns the state (the tuple of the last n-1 words) reached when
+        words are appended to a hypothesis whose state is state
+        """
+        state = state + tuple(words)
+        return state[max(len(state) - (self.ngrams_length - 1), 0):]
+
 
+class Vocabulary(object):
+    """
+    Maps the words handled by the decoder to consecutive integer ids
+    """
 
-class BfsHypdata:
     def __init__(self):
-        self.coverage = []
-        self.words = ""
+        self.ids = {}
+        self.words = []
 
-    def __str__(self):
-        result = "cov:"
-        for k in range(len(self.coverage)):
-            result = result + " " + str(self.coverage[k])
-        result = result + " ; words: " + self.words.encode("utf-8")
-        return result
+    def __len__(self):
+        return len(self.words)
 
+    def word_id(self, word):
+        wid = self.ids.get(word)
+        if wid is None:
+            wid = self.ids[word] = len(self.words)
+            self.words.append(word)
+        return wid
 
-class Hypothesis:
-    def __init__(self):
-        self.score = 0
-        self.data = BfsHypdata()
+    def word(self, wid):
+        return self.words[wid]
+
+    def to_ids(self, words):
+        return tuple(self.word_id(word) for word in words)
+
+    def to_words(self, ids):
+        return [self.words[wid] for wid in ids]
+
+
+class Hypothesis(object):
+    """
+    Partial translation of the source sentence.  The words and the covered
+    source positions are not copied from the hypothesis this one was
+    expanded from, they are rebuilt following the parent pointers when the
+    output is produced.
+    """
+    __slots__ = ('score', 'parent', 'last_cov_pos', 'words', 'lm_state', 'priority')
+
+    def __init__(self, score=0, parent=None, last_cov_pos=-1, words=(), lm_state=(), priority=0):
+        self.score = score
+        # Hypothesis this one was expanded from, last source position
+        # covered and ids of the words added by that expansion
+        self.parent = parent
+        self.last_cov_pos = last_cov_pos
+        self.words = words
+        # Ids of the last n-1 words, including <bos>
+        self.lm_state = lm_state
+        # Score plus the estimation of the score of the words not covered yet
+        self.priority = priority
 
     def __lt__(self, other):
-        # by default we want to have hypothesis with higher score at the beginning
-        return self.score > other.score
+        # by default we want to have hypothesis with higher priority at the beginning
+        return self.priority > other.priority
 
 
 class PriorityQueue:
@@ -179,48 +272,34 @@ class PriorityQueue:
 
 
 class StateInfoDict:
+    """
+    Best score found for each search state, a tuple (last covered source
+    position, lm state)
+    """
+
     def __init__(self):
         self.recomb_map = {}
 
     def empty(self):
         return len(self.recomb_map) == 0
 
-    def insert(self, state_info, score):
+    def insert(self, state, score):
         # Update recombination info
-        if state_info in self.recomb_map:
-            if score > self.recomb_map[state_info]:
-                self.recomb_map[state_info] = score
-        else:
-            self.recomb_map[state_info] = score
-
-    def get(self):
-        return heappop(self.heap)
-
-    def hyp_recombined(self, state_info, score):
-
-        if state_info in self.recomb_map:
-            if score < self.recomb_map[state_info]:
-                return True
-            else:
-                return False
-        else:
-            return False
-
-
-class StateInfo:
-    def __init__(self, tm_state, lm_state):
-        self.tm_state = tm_state
-        self.lm_state = lm_state
-
-    def __hash__(self):
-        return hash((self.tm_state, self.lm_state))
-
-    def __eq__(self, other):
-        return (self.tm_state, self.lm_state) == (other.tm_state, other.lm_state)
+        if score > self.recomb_map.get(state, float('-inf')):
+            self.recomb_map[state] = score
 
+    def hyp_recombined(self, state, score):
+        """
+        returns True if a better hypothesis with the same state was found
+        """
+        return score < self.recomb_map.get(state, float('-inf'))
 
-def obtain_state_info(tmodel, lmodel, hyp):
-    return StateInfo(tmodel.get_mon_hyp_state(hyp), lmodel.get_hyp_state(hyp))
+    def hyp_dominated(self, state, score):
+        """
+        returns True if a hypothesis with the same state and at least the
+        same score was found
+        """
+        return score <= self.recomb_map.get(state, float('-inf'))
 
 
 def areCategsPaired(categ_src_ann_words_array, categ_trg_ann_words_array):
@@ -250,15 +329,11 @@ def areCategsPaired(categ_src_ann_words_array, categ_trg_ann_words_array):
 def categ_src_trg_annotation(src_ann_words, trg_ann_words):
     # Obtain array with source words (with a without categorization)
     src_ann_words_array = src_ann_words.split()
-    categ_src_ann_words_array = []
-    for i in range(len(src_ann_words_array)):
-        categ_src_ann_words_array.append(categorize_word(src_ann_words_array[i]))
+    categ_src_ann_words_array = categorize_text(u' '.join(src_ann_words_array)).split()
 
     # Obtain array with target words (with a without categorization)
     trg_ann_words_array = trg_ann_words.split()
-    categ_trg_ann_words_array = []
-    for i in range(len(trg_ann_words_array)):
-        categ_trg_ann_words_array.append(categorize_word(trg_ann_words_array[i]))
+    categ_trg_ann_words_array = categorize_text(u' '.join(trg_ann_words_array)).split()
 
     # Verify that categories are paired
     if areCategsPaired(categ_src_ann_words_array, categ_trg_ann_words_array):
@@ -268,147 +343,178 @@ def categ_src_trg_annotation(src_ann_words, trg_ann_words):
 
 
 ##################################################
-def categorize(sentence):
-    skeleton = list(annotated_string_to_xml_skeleton(sentence))
-
-    # Categorize words
-    categ_word_array = []
+def categorize_xml_skeleton(skeleton):
+    """
+    Categorizes the words of a skeleton of (is_tag, tokens) pairs
+    returns a new skeleton
+    """
+    categ_skeleton = []
     curr_xml_tag = None
-    for i in range(len(skeleton)):
-        is_tag, word = skeleton[i]
+    for is_tag, tokens in skeleton:
         if is_tag:
+            word = tokens[0]
             # Treat xml tag
             if word == '<' + config.len_ann + '>':
-                categ_word_array.append(word)
+                categ_skeleton.append((True, [word]))
                 curr_xml_tag = "len_ann"
             elif word == '<' + config.grp_ann + '>':
-                categ_word_array.append(word)
+                categ_skeleton.append((True, [word]))
             elif word == '<' + config.src_ann + '>':
                 curr_xml_tag = "src_ann"
             elif word == '<' + config.trg_ann + '>':
                 curr_xml_tag = "trg_ann"
             elif word == '</' + config.len_ann + '>':
-                categ_word_array.append(word)
+                categ_skeleton.append((True, [word]))
                 curr_xml_tag = None
             elif word == '</' + config.grp_ann + '>':
-                categ_word_array.append(word)
+                categ_skeleton.append((True, [word]))
             elif word == '</' + config.src_ann + '>':
                 curr_xml_tag = None
             elif word == '</' + config.trg_ann + '>':
                 curr_xml_tag = None
                 categ_src_words, categ_trg_words = categ_src_trg_annotation(src_ann_words, trg_ann_words)
                 # Add source phrase
-                categ_word_array.append('<' + config.src_ann + '>')
-                for i in range(len(categ_src_words)):
-                    categ_word_array.append(categ_src_words[i])
-                categ_word_array.append('</' + config.src_ann + '>')
+                categ_skeleton.append((True, ['<' + config.src_ann + '>']))
+                categ_skeleton.append((False, list(categ_src_words)))
+                categ_skeleton.append((True, ['</' + config.src_ann + '>']))
                 # Add target phrase
-                categ_word_array.append('<' + config.trg_ann + '>')
-                for i in range(len(categ_trg_words)):
-                    categ_word_array.append(categ_trg_words[i])
-                categ_word_array.append('</' + config.trg_ann + '>')
+                categ_skeleton.append((True, ['<' + config.trg_ann + '>']))
+                categ_skeleton.append((False, list(categ_trg_words)))
+                categ_skeleton.append((True, ['</' + config.trg_ann + '>']))
         else:
+            word = u' '.join(tokens)
             # Categorize group of words
             if curr_xml_tag is None:
-                word_array = word.split()
-                for j in range(len(word_array)):
-                    categ_word_array.append(categorize_word(word_array[j]))
+                categ_skeleton.append((False, categorize_text(word).split()))
             elif curr_xml_tag == "len_ann":
-                word_array = word.split()
-                for j in range(len(word_array)):
-                    categ_word_array.append(word)
+                categ_skeleton.append((False, [word for _ in word.split()]))
             elif curr_xml_tag == "src_ann":
                 src_ann_words = word
             elif curr_xml_tag == "trg_ann":
                 trg_ann_words = word
 
-    return u' '.join(categ_word_array)
+    return categ_skeleton
+
+
+def categorize(sentence):
+    if '<' not in sentence:
+        return categorize_text(u' '.join(sentence.split()))
+    skeleton = annotated_string_to_token_skeleton(sentence)
+    return u' '.join(xml_skeleton_to_tokens(categorize_xml_skeleton(skeleton)))
 
 
 def categorize_word(word):
-    if word.isdigit():
-        if len(word) > 1:
-            return config.number_str
-        else:
-            return config.digit_str
-    elif is_number(word):
-        return config.number_str
-    elif is_alnum(word) and config.digits.search(word):
-        return config.alfanum_str
+    categ = classify_word(word)
+    if categ is not None:
+        return categ
     else:
         return word
 
 
-def extract_alig_info(hyp_word_array):
-    
-    srcsegms=obtain_source_segments(hyp_word_array)
-    trgcuts=obtain_target_cuts(hyp_word_array)
-    
-    return (srcsegms,trgcuts)
-
-
-def obtain_source_segments(hyp_word_array):
-
-    # Initialize output variables
-    srcsegms=[]
-
-    # Obtain source segments
-    info_found=False
-    for i in range(2,len(hyp_word_array)):
-        if(hyp_word_array[i]=="Segmentation:" and hyp_word_array[i-1]=="Source" and hyp_word_array[i-2]=="|"):
-            info_found=True
-            i+=1
-            break;
-
-    srcsegms_found=False
-    if(info_found):
-        while i<len(hyp_word_array):
-            if(hyp_word_array[i]=="("):
-                if(i+3<len(hyp_word_array)):
-                    srcsegms.append((int(hyp_word_array[i+1]),int(hyp_word_array[i+3])))
-                i+=1
-            elif(hyp_word_array[i]=="|"):
-                srcsegms_found=True
-                break
-            else:
-                i+=1
-            
-    # Return result
-    if(srcsegms_found):
-        return srcsegms
-    else:
-        return []
+def _categorize_match(match):
+    return categorize_word(match.group())
 
 
-def obtain_target_cuts(hyp_word_array):
+try:
+    _unichr = unichr
+except NameError:
+    _unichr = chr
 
-    # Initialize output variables
-    trgcuts=[]
+_decimal_digit = re.compile(u'\\d', flags=re.U)
 
-    # Obtain target segment cuts
-    info_found=False
-    for i in range(2,len(hyp_word_array)):
-        if(hyp_word_array[i]=="Segmentation:" and hyp_word_array[i-1]=="Target" and hyp_word_array[i-2]=="|"):
-            info_found=True
-            i+=1
-            break;
+# Matches the words that may belong to a category: the ones containing a
+# digit and the float() spellings of infinity and NaN.  It is built on first
+# use because finding the digit characters not matched by \d (e.g.
+# superscripts) requires scanning the whole unicode range.
+_categ_candidate = None
 
-    trgcuts_found=False
-    if(info_found):
-        while i<len(hyp_word_array):
-            if(hyp_word_array[i]!="|"):
-                trgcuts.append(int(hyp_word_array[i]))
-                i+=1
-            else:
-                trgcuts_found=True
-                i+=1
-                break
 
-    # Return result
-    if(trgcuts_found):
-        return trgcuts
-    else:
-        return []
+def _get_categ_candidate():
+    global _categ_candidate
+    if _categ_candidate is None:
+        other_digits = u''.join(
+            c for c in map(_unichr, range(sys.maxunicode + 1)) if c.isdigit() and not _decimal_digit.match(c)
+        )
+        _categ_candidate = re.compile(
+            u'(?<!\\S)(?:\\S*[\\d%s]\\S*|[+-]?(?:inf(?:inity)?|nan)(?!\\S))' % re.escape(other_digits),
+            flags=re.I | re.U,
+        )
+    return _categ_candidate
+
+
+def categorize_text(text):
+    """
+    Categorizes the words of a string of space separated words in a single
+    pass, the words that don't belong to any category are left unchanged
+    """
+    return _get_categ_candidate().sub(_categorize_match, text)
+
+
+def extract_alig_info(hyp_word_array):
+    try:
+        srcsegms, trgcuts = parse_alig_info(hyp_word_array)
+    except ValueError as e:
+        print("Warning: %s" % e, file=sys.stderr)
+        return [], []
+    return list(zip(srcsegms[::2], srcsegms[1::2])), list(trgcuts)
+
+
+def _parse_int(word, what):
+    try:
+        return int(word)
+    except ValueError:
+        raise ValueError("malformed %s in hypothesis alignment info: %s" % (what, word))
+
+
+def parse_alig_info(hyp_word_array):
+    """
+    Extracts the source segmentation and the target cuts of a Thot
+    hypothesis in a single scan
+    returns a pair of integer arrays, the first one with the first and last
+    source positions of each segment one after the other, the second one
+    with the target cuts.  They are empty if the hypothesis has no
+    alignment info, ValueError is raised if it is malformed.
+    """
+    srcsegms = array('i')
+    trgcuts = array('i')
+    src_found = False
+    trg_found = False
+    num_words = len(hyp_word_array)
+    i = 0
+    while i < num_words:
+        if (hyp_word_array[i] != "|" or i + 2 >= num_words or hyp_word_array[i + 2] != "Segmentation:" or
+                hyp_word_array[i + 1] not in ("Source", "Target")):
+            i += 1
+            continue
+
+        source = hyp_word_array[i + 1] == "Source"
+        if (source and src_found) or (not source and trg_found):
+            i += 1
+            continue
+
+        # Read the section up to the bar that closes it
+        i += 3
+        while i < num_words and hyp_word_array[i] != "|":
+            word = hyp_word_array[i]
+            if not source:
+                trgcuts.append(_parse_int(word, "target cut"))
+            elif word == "(":
+                if i + 4 >= num_words or hyp_word_array[i + 2] != "," or hyp_word_array[i + 4] != ")":
+                    raise ValueError("malformed source segment in hypothesis alignment info")
+                srcsegms.append(_parse_int(hyp_word_array[i + 1], "source segment"))
+                srcsegms.append(_parse_int(hyp_word_array[i + 3], "source segment"))
+                i += 4
+            i += 1
+
+        if i >= num_words:
+            raise ValueError("unterminated %s segmentation in hypothesis alignment info" %
+                             ("source" if source else "target"))
+        if source:
+            src_found = True
+        else:
+            trg_found = True
+
+    return srcsegms, trgcuts
 
 
 def extract_categ_words_of_segm(word_array, left, right):
@@ -430,84 +536,121 @@ def decategorize(sline, tline, iline):
     hyp_word_array = iline.split()
 
     # Extract alignment information
-    srcsegms, trgcuts = extract_alig_info(hyp_word_array)
+    try:
+        srcsegms, trgcuts = parse_alig_info(hyp_word_array)
+    except ValueError as e:
+        print("Warning: %s" % e, file=sys.stderr)
+        srcsegms, trgcuts = (), ()
 
-    # Iterate over target words
-    output = ""
-    for trgpos in range(len(trg_word_array)):
+    decategorizer = Decategorizer(src_word_array, srcsegms, trgcuts)
+    return u' '.join(decategorizer.decategorize(trg_word_array))
 
-        if is_categ(trg_word_array[trgpos]):
-            output += decategorize_word(trgpos, src_word_array, trg_word_array, srcsegms, trgcuts)
-        else:
-            output += trg_word_array[trgpos]
 
-        if trgpos < len(trg_word_array) - 1:
-            output += " "
+def decategorize_word(trgpos, src_word_array, trg_word_array, srcsegms, trgcuts):
+    flat_srcsegms = [pos for srcsegm in srcsegms for pos in srcsegm]
+    decategorizer = Decategorizer(src_word_array, flat_srcsegms, trgcuts)
+    return decategorizer.decategorize_word(trg_word_array, trgpos)
+
 
-    return output
+class Decategorizer(object):
+    """
+    Replaces the categories of a target sentence with the source words they
+    were obtained from.  The n-th occurrence of a category in a target
+    segment is replaced with the n-th source word of that category in the
+    aligned source segment, the categories that can't be aligned are left
+    unchanged.  The alignment is given as returned by parse_alig_info.
+    """
 
+    def __init__(self, src_word_array, srcsegms, trgcuts):
+        self.src_word_array = src_word_array
+        self.srcsegms = srcsegms
+        self.trgcuts = trgcuts
+        # Source words of each category, indexed by segment and computed
+        # the first time the segment is used
+        self.src_categ_words = {}
 
-def decategorize_word(trgpos, src_word_array, trg_word_array, srcsegms, trgcuts):
-    # Check if there is alignment information available
-    if len(srcsegms) == 0 or len(trgcuts) == 0:
-        return trg_word_array
-    else:
-        # Scan target cuts
-        for k in range(len(trgcuts)):
-            if k == 0:
-                if trgpos + 1 <= trgcuts[k]:
-                    trgleft = 0
-                    trgright = trgcuts[k] - 1
-                    break
-            else:
-                if trgpos + 1 > trgcuts[k - 1] and trgpos + 1 <= trgcuts[k]:
-                    trgleft = trgcuts[k - 1]
-                    trgright = trgcuts[k] - 1
-                    break
-        # Check if trgpos'th word was assigned to one cut
-        if k < len(trgcuts):
-            # Obtain source segment limits
-            srcleft = srcsegms[k][0] - 1
-            srcright = srcsegms[k][1] - 1
-            # Obtain categorized words with their indices
-            src_categ_words = extract_categ_words_of_segm(src_word_array, srcleft, srcright)
-            trg_categ_words = extract_categ_words_of_segm(trg_word_array, trgleft, trgright)
-
-            # Obtain decategorized word
-            decateg_word = ""
-            curr_categ_word = trg_word_array[trgpos]
-            curr_categ_word_order = 0
-            for l in range(len(trg_categ_words)):
-                if trg_categ_words[l][0] == trgpos:
-                    break
-                else:
-                    if trg_categ_words[l][1] == curr_categ_word:
-                        curr_categ_word_order += 1
-
-            aux_order = 0
-            for l in range(len(src_categ_words)):
-                if categorize_word(src_categ_words[l][1]) == curr_categ_word:
-                    if aux_order == curr_categ_word_order:
-                        decateg_word = src_categ_words[l][1]
-                        break
-                    else:
-                        aux_order += 1
-
-            # Return decategorized word
-            if decateg_word == "":
-                return trg_word_array[trgpos]
+    def segment_of(self, trgpos):
+        """
+        Returns the index of the segment containing the trgpos'th target
+        word, or None if it is not covered by the alignment
+        """
+        k = bisect_left(self.trgcuts, trgpos + 1)
+        if k < len(self.trgcuts) and 2 * k + 1 < len(self.srcsegms):
+            return k
+        return None
+
+    def source_categ_words(self, k):
+        categ_words = self.src_categ_words.get(k)
+        if categ_words is None:
+            categ_words = self.src_categ_words[k] = {}
+            srcleft = max(self.srcsegms[2 * k] - 1, 0)
+            srcright = self.srcsegms[2 * k + 1] - 1
+            for word in self.src_word_array[srcleft:srcright + 1]:
+                categ = categorize_word(word)
+                if is_categ(categ):
+                    categ_words.setdefault(categ, []).append(word)
+        return categ_words
+
+    def decategorize_categ(self, categ, k, order):
+        src_words = self.source_categ_words(k).get(categ, ())
+        if order < len(src_words):
+            return src_words[order]
+        return categ
+
+    def decategorize(self, trg_word_array):
+        """
+        returns a list with the decategorized target words
+        """
+        output = []
+        # Number of occurrences of each category seen in each segment
+        orders = {}
+        for trgpos, word in enumerate(trg_word_array):
+            k = self.segment_of(trgpos) if is_categ(word) else None
+            if k is None:
+                output.append(word)
             else:
-                return decateg_word
-        else:
-            return trg_word_array[trgpos]
+                order = orders.get((k, word), 0)
+                orders[k, word] = order + 1
+                output.append(self.decategorize_categ(word, k, order))
+        return output
+
+    def decategorize_word(self, trg_word_array, trgpos):
+        word = trg_word_array[trgpos]
+        k = self.segment_of(trgpos)
+        if k is None:
+            return word
+        trgleft = self.trgcuts[k - 1] if k > 0 else 0
+        order = trg_word_array[trgleft:trgpos].count(word)
+        return self.decategorize_categ(word, k, order)
+
+
+SEARCH_ALGORITHMS = ('best-first', 'viterbi', 'beam')
+DEFAULT_BEAM_WIDTH = 10
+DEFAULT_LM_CACHE_SIZE = 100000
+DEFAULT_TM_CACHE_SIZE = 10000
+DEFAULT_PRELOAD_MAX_MB = 1024
 
 
 class Decoder:
-    def __init__(self, tmodel, lmodel, weights):
+    def __init__(self, tmodel, lmodel, weights, search='best-first', beam_width=DEFAULT_BEAM_WIDTH,
+                 beam_threshold=None, lm_cache_size=DEFAULT_LM_CACHE_SIZE, tm_cache_size=DEFAULT_TM_CACHE_SIZE,
+                 future_cost=True, phrase_trie=False):
+        if search not in SEARCH_ALGORITHMS:
+            raise ValueError("Unknown search algorithm: %s" % search)
+        if beam_width <= 0:
+            raise ValueError("The beam width must be positive: %s" % beam_width)
+        if beam_threshold is not None and beam_threshold < 0:
+            raise ValueError("The beam threshold must not be negative: %s" % beam_threshold)
+
         # Initialize data members
         self.tmodel = tmodel
         self.lmodel = lmodel
         self.weights = weights
+        self.search = search
+        # Pruning of the beam search: maximum number of hypotheses expanded
+        # per stack and maximum score difference with the best one
+        self.beam_width = beam_width
+        self.beam_threshold = beam_threshold
 
         # Checking on weight list
         if len(self.weights) != 4:
@@ -524,6 +667,35 @@ class Decoder:
         self.wpenw_idx = 2
         self.lmw_idx = 3
 
+        # Hypotheses store word ids, strings are only built to query the
+        # models and to produce the output
+        self.vocab = Vocabulary()
+        self.bos_id = self.vocab.word_id(config.bos_str)
+        self.eos_id = self.vocab.word_id(config.eos_str)
+
+        # Translation options of the spans of the sentence being decoded and
+        # optimistic estimation of the score of covering each suffix of it
+        self.lattice = {}
+        self.use_future_cost = future_cost
+        self.future_cost = []
+        self.counters = Counter()
+
+        # Caches shared by all the sentences: n-gram (as a tuple of word
+        # ids) -> lm logprob, and source words -> translation options
+        self.lm_cache = LRUCache(lm_cache_size) if lm_cache_size > 0 else None
+        self.tm_cache = LRUCache(tm_cache_size) if tm_cache_size > 0 else None
+
+        # Prefix tree of the sources of the translation model, spans are
+        # not extended once they stop being a prefix of any of them.  It is
+        # built in memory from every source of the model, so it is only used
+        # when requested.  With it the multi-word spans looked up in the
+        # model are known to be sources, so the Bloom filter of the sqlite
+        # providers only rejects unknown single words
+        self.source_trie = tmodel.obtain_source_trie() if phrase_trie else None
+        # Last positions of the spans considered from each position of the
+        # sentence being decoded
+        self.span_ends = []
+
     def opt_contains_src_words(self, src_words, opt):
 
         st = ""
@@ -536,17 +708,67 @@ class Decoder:
         else:
             return False
 
-    def tm_ext_lp(self, new_src_words, opt, verbose):
-
-        lp = math.log(self.tmodel.obtain_trgsrc_prob_smoothed(new_src_words, opt))
-
-        if verbose:
-            print(
-                "  tm: logprob(", opt.encode("utf-8"), "|", new_src_words.encode("utf-8"), ")=", lp,
-                file=sys.stderr
-            )
-
-        return lp
+    def obtain_span_ends(self, tok_array):
+        """
+        returns a list whose j'th element is the list of the last positions
+        of the spans starting at j that may have translation options: the
+        spans of at most a_par words, and with the phrase trie only those
+        that are sources of the model plus the single words (they always
+        get an option)
+        """
+        num_words = len(tok_array)
+        span_ends = []
+        for first in range(num_words):
+            end = min(first + config.a_par, num_words)
+            if self.source_trie is None:
+                span_ends.append(list(range(first, end)))
+            else:
+                lasts = [match_end - 1 for match_end in self.source_trie.match_ends(tok_array, first, end)]
+                if not lasts or lasts[0] != first:
+                    lasts.insert(0, first)
+                self.counters['spans pruned'] += end - first - len(lasts)
+                span_ends.append(lasts)
+        return span_ends
+
+    def build_lattice(self, tok_array, span_ends=None):
+        """
+        Obtains the translation options of the spans of tok_array given by
+        span_ends (see obtain_span_ends) with a single batched model query
+        returns a dictionary mapping each span (first, last) to a list of
+        (option, option word ids, tm logprob) tuples
+        """
+        if span_ends is None:
+            span_ends = self.obtain_span_ends(tok_array)
+        spans = {}
+        for first, lasts in enumerate(span_ends):
+            for last in lasts:
+                spans[first, last] = u" ".join(tok_array[first:last + 1])
+
+        src_options = {}
+        if self.tm_cache is not None:
+            for src in set(spans.values()):
+                options = self.tm_cache.get(src)
+                if options is not None:
+                    src_options[src] = options
+        missing_srcs = set(src for src in spans.values() if src not in src_options)
+        if missing_srcs:
+            for src, (src_count, opt_counts) in self.tmodel.obtain_opts_batch(missing_srcs).items():
+                src_options[src] = options = [
+                    (opt, self.vocab.to_ids(opt.split()), math.log(self.tmodel.smoothed_prob(src_count, count)))
+                    for opt, count in opt_counts
+                ]
+                if self.tm_cache is not None:
+                    self.tm_cache.put(src, options)
+
+        lattice = {}
+        for (first, last), src in spans.items():
+            options = src_options.get(src, [])
+            # If there are no options and only one source word is being
+            # covered, artificially add one
+            if len(options) == 0 and first == last:
+                options = [(src, self.vocab.to_ids([src]), math.log(self.tmodel.smoothed_prob(0, 0)))]
+            lattice[first, last] = options
+        return lattice
 
     def pp_ext_lp(self, verbose):
         lp = math.log(1.0 / math.e)
@@ -554,9 +776,7 @@ class Decoder:
             print("  pp:", lp, file=sys.stderr)
         return lp
 
-    def wp_ext_lp(self, words, verbose):
-
-        nw = len(words.split())
+    def wp_ext_lp(self, nw, verbose):
 
         lp = nw * math.log(1 / math.e)
 
@@ -576,90 +796,169 @@ class Decoder:
         else:
             return word
 
-    def lm_ext_lp(self, hyp_words, opt, verbose):
+    def lm_ngram_lp(self, ngram):
+        """
+        returns the logprob of the last word of ngram, a tuple of word ids,
+        given the previous ones
+        """
+        if self.lm_cache is not None:
+            lp = self.lm_cache.get(ngram)
+            if lp is not None:
+                return lp
+        words = [self.lm_transform_word(word) for word in self.vocab.to_words(ngram)]
+        lp = self.lmodel.obtain_trgsrc_interp_logprob(u" ".join(words))
+        if self.lm_cache is not None:
+            self.lm_cache.put(ngram, lp)
+        return lp
+
+    def lm_ext_lp(self, lm_state, opt_words, verbose):
         # Obtain lm history
-        rawhist = self.lmodel.get_lm_state(hyp_words)
-        rawhist_array = rawhist.split()
-        hist = ""
-        for i in range(len(rawhist_array)):
-            word = self.lm_transform_word(rawhist_array[i])
-            if hist == "":
-                hist = word
-            else:
-                hist = hist + " " + word
+        hist = lm_state
 
         # Obtain logprob for new words
         lp = 0
-        opt_words_array = opt.split()
-        for i in range(len(opt_words_array)):
-            word = self.lm_transform_word(opt_words_array[i])
-            if hist == "":
-                ngram = word
-            else:
-                ngram = hist + " " + word
-            lp_ng = math.log(self.lmodel.obtain_trgsrc_interp_prob(ngram))
+        for word in opt_words:
+            ngram = hist + (word,)
+            lp_ng = self.lm_ngram_lp(ngram)
             lp += lp_ng
             if verbose:
-                print("  lm: logprob(", word.encode("utf-8"), "|", hist.encode("utf-8"), ")=", lp_ng, file=sys.stderr)
+                print(
+                    "  lm: logprob(", self.vocab.word(word).encode("utf-8"), "|",
+                    u" ".join(self.vocab.to_words(hist)).encode("utf-8"), ")=", lp_ng, file=sys.stderr
+                )
 
-            hist = self.lmodel.remove_oldest_word(ngram)
+            hist = ngram[1:]
 
         return lp
 
-    def expand(self, tok_array, hyp, new_hyp_cov, verbose):
+    def lm_upper_bound(self, hist, word):
+        """
+        returns an upper bound of the logprob of word given any history
+        ending with hist
+        """
+        p = math.exp(self.lm_ngram_lp(hist + (word,)))
+        # Each interpolation level with unknown history words contributes
+        # at most interp_prob * 1
+        for _ in range(self.lmodel.ngrams_length - 1 - len(hist)):
+            p = self.lmodel.interp_prob + (1 - self.lmodel.interp_prob) * p
+        return math.log(p)
+
+    def obtain_future_cost(self, src_word_array):
+        """
+        returns a list whose j'th element is an upper bound of the score
+        obtained when covering the source words from j to the end of the
+        sentence (0 for j = len(src_word_array)).  The lattice must have
+        been built and the weights are assumed to be non negative.  Used as
+        the A* heuristic of the best-first search.
+        """
+        num_words = len(src_word_array)
+        w_lm = self.weights[self.lmw_idx]
+        end_lp = w_lm * self.lm_upper_bound((), self.eos_id)
+        future_cost = [float('-inf')] * num_words + [0]
+        for first in range(num_words - 1, -1, -1):
+            for last in self.span_ends[first]:
+                rest = future_cost[last + 1] if last + 1 < num_words else end_lp
+                for opt, opt_words, tm_lp in self.lattice[first, last]:
+                    # Within an option the history ends with the previous
+                    # word of the option
+                    lm_lp = 0
+                    hist = ()
+                    for word in opt_words:
+                        lm_lp += self.lm_upper_bound(hist, word)
+                        if self.lmodel.ngrams_length > 1:
+                            hist = (word,)
+                    score = (
+                        self.weights[self.tmw_idx] * tm_lp + self.weights[self.phrpenw_idx] * self.pp_ext_lp(False) +
+                        self.weights[self.wpenw_idx] * self.wp_ext_lp(len(opt_words), False) + w_lm * lm_lp + rest
+                    )
+                    if score > future_cost[first]:
+                        future_cost[first] = score
+        return future_cost
+
+    def stats(self):
+        """
+        returns a list of lines describing the work done by the decoder and
+        the use of the caches
+        """
+        lines = [
+            "Expanded hypotheses: %d" % self.counters['expansions'],
+            "Pushes avoided by recombination: %d" % self.counters['pushes avoided'],
+        ]
+        if self.lm_cache is not None:
+            lines.append("LM cache: " + self.lm_cache.stats())
+        if self.tm_cache is not None:
+            lines.append("TM cache: " + self.tm_cache.stats())
+        if self.source_trie is not None:
+            lines.append("Spans pruned by the phrase trie: %d" % self.counters['spans pruned'])
+        lines.extend(self.tmodel.stats())
+        return lines
+
+    def hyp_words(self, hyp):
+        """
+        returns the list of target words of hyp, rebuilt following the
+        back-pointers of the hypothesis
+        """
+        words = []
+        while hyp is not None:
+            words.extend(reversed(hyp.words))
+            hyp = hyp.parent
+        words.reverse()
+        return self.vocab.to_words(words)
+
+    def hyp_coverage(self, hyp):
+        """
+        returns the last source position covered by each expansion of hyp
+        """
+        coverage = []
+        while hyp.parent is not None:
+            coverage.append(hyp.last_cov_pos)
+            hyp = hyp.parent
+        coverage.reverse()
+        return coverage
+
+    def hyp_to_str(self, hyp):
+        return "cov:" + "".join(" " + str(pos) for pos in self.hyp_coverage(hyp)) + " ; words: " + \
+            u" ".join(self.hyp_words(hyp))
+
+    def expand(self, tok_array, hyp, new_hyp_cov, verbose, stdict=None):
+        """
+        returns the list of hypotheses obtained by translating the source
+        words after the coverage of hyp up to new_hyp_cov.  If a state
+        dictionary is given, the expansions dominated by a hypothesis with
+        the same state are discarded before being created and the state of
+        the rest is registered in it.
+        """
         # Init result
         exp_list = []
 
-        # Obtain words to be translated
-        new_src_words = ""
-        last_cov_pos = self.last_cov_pos(hyp.data.coverage)
-        for i in range(last_cov_pos + 1, new_hyp_cov + 1):
-            if new_src_words == "":
-                new_src_words = tok_array[i]
-            else:
-                new_src_words = new_src_words + " " + tok_array[i]
-
-        # Obtain translation options
-        opt_list = self.tmodel.obtain_opts_for_src(new_src_words)
-
-        # If there are no options and only one source word is being covered,
-        # artificially add one
-        if len(opt_list) == 0 and len(new_src_words.split()) == 1:
-            opt_list.append(new_src_words)
+        # Obtain translation options of the words to be translated
+        last_cov_pos = hyp.last_cov_pos
+        opt_list = self.lattice[last_cov_pos + 1, new_hyp_cov]
 
         # Print information about expansion if in verbose mode
         if verbose:
+            new_src_words = u" ".join(tok_array[last_cov_pos + 1:new_hyp_cov + 1])
             print(
                 "++ expanding -> new_hyp_cov:", new_hyp_cov, "; new_src_words:", new_src_words.encode("utf-8"),
                 "; num options:", len(opt_list), file=sys.stderr
             )
 
         # Iterate over options
-        for opt in opt_list:
+        for opt, opt_words, tm_lp in opt_list:
 
             if verbose:
                 print("   option:", opt.encode("utf-8"), file=sys.stderr)
 
             # Extend hypothesis
 
-            # Obtain new hypothesis
-            bfsd_newhyp = BfsHypdata()
-
-            # Obtain coverage for new hyp
-            bfsd_newhyp.coverage = hyp.data.coverage[:]
-            bfsd_newhyp.coverage.append(new_hyp_cov)
-
-            # Obtain list of words for new hyp
-            if hyp.data.words == "":
-                bfsd_newhyp.words = opt
-            else:
-                bfsd_newhyp.words = hyp.data.words
-                bfsd_newhyp.words = bfsd_newhyp.words + " " + opt
+            # Obtain lm state for new hyp
+            lm_state = self.lmodel.extend_lm_state(hyp.lm_state, opt_words)
 
             # Obtain score for new hyp
 
             # Add translation model contribution
-            tm_lp = self.tm_ext_lp(new_src_words, opt, verbose)
+            if verbose:
+                print("  tm: logprob(", opt.encode("utf-8"), ")=", tm_lp, file=sys.stderr)
             w_tm_lp = self.weights[self.tmw_idx] * tm_lp
 
             # Add phrase penalty contribution
@@ -667,18 +966,18 @@ class Decoder:
             w_pp_lp = self.weights[self.phrpenw_idx] * pp_lp
 
             # Add word penalty contribution
-            wp_lp = self.wp_ext_lp(opt, verbose)
+            wp_lp = self.wp_ext_lp(len(opt_words), verbose)
             w_wp_lp = self.weights[self.wpenw_idx] * wp_lp
 
             # Add language model contribution
-            lm_lp = self.lm_ext_lp(hyp.data.words, opt, verbose)
+            lm_lp = self.lm_ext_lp(hyp.lm_state, opt_words, verbose)
             w_lm_lp = self.weights[self.lmw_idx] * lm_lp
 
             # Add language model contribution for <bos> if hyp is
             # complete
             w_lm_end_lp = 0
-            if self.cov_is_complete(bfsd_newhyp.coverage, tok_array):
-                lm_end_lp = self.lm_ext_lp(bfsd_newhyp.words, config.eos_str, verbose)
+            if new_hyp_cov == len(tok_array) - 1:
+                lm_end_lp = self.lm_ext_lp(lm_state, (self.eos_id,), verbose)
                 w_lm_end_lp = self.weights[self.lmw_idx] * lm_end_lp
 
             if verbose:
@@ -686,13 +985,24 @@ class Decoder:
                     "   expansion ->", "w. lp:", hyp.score + w_tm_lp + w_pp_lp + w_lm_lp + w_lm_end_lp,
                     "; w. tm logprob:", w_tm_lp,
                     "; w. pp logprob:", w_pp_lp, "; w. wp logprob:", w_wp_lp, "; w. lm logprob:", w_lm_lp,
-                    "; w. lm end logprob:", w_lm_end_lp, ";", str(bfsd_newhyp), file=sys.stderr)
+                    "; w. lm end logprob:", w_lm_end_lp, "; cov:", self.hyp_coverage(hyp) + [new_hyp_cov],
+                    "; words:", u" ".join(self.hyp_words(hyp) + opt.split()).encode("utf-8"), file=sys.stderr)
                 print("   ----", file=sys.stderr)
 
+            score = hyp.score + w_tm_lp + w_pp_lp + w_wp_lp + w_lm_lp + w_lm_end_lp
+
+            # Recombine hypothesis
+            if stdict is not None:
+                state = (new_hyp_cov, lm_state)
+                if stdict.hyp_dominated(state, score):
+                    self.counters['pushes avoided'] += 1
+                    continue
+                stdict.insert(state, score)
+
             # Obtain new hypothesis
-            newhyp = Hypothesis()
-            newhyp.score = hyp.score + w_tm_lp + w_pp_lp + w_wp_lp + w_lm_lp + w_lm_end_lp
-            newhyp.data = bfsd_newhyp
+            newhyp = Hypothesis(
+                score, hyp, new_hyp_cov, opt_words, lm_state, score + self.future_cost[new_hyp_cov + 1]
+            )
 
             # Add expansion to list
             exp_list.append(newhyp)
@@ -700,34 +1010,35 @@ class Decoder:
         # Return result
         return exp_list
 
-    def last_cov_pos(self, coverage):
-
-        if len(coverage) == 0:
-            return -1
-        else:
-            return coverage[len(coverage) - 1]
-
     def hyp_is_complete(self, hyp, src_word_array):
 
-        return self.cov_is_complete(hyp.data.coverage, src_word_array)
+        return hyp.last_cov_pos == len(src_word_array) - 1
 
-    def cov_is_complete(self, coverage, src_word_array):
+    def initial_hypothesis(self):
+        hyp = Hypothesis()
+        hyp.lm_state = self.lmodel.extend_lm_state((), (self.bos_id,))
+        return hyp
 
-        if self.last_cov_pos(coverage) == len(src_word_array) - 1:
-            return True
+    def obtain_nblist(self, src_word_array, nblsize, verbose):
+        self.span_ends = self.obtain_span_ends(src_word_array)
+        self.lattice = self.build_lattice(src_word_array, self.span_ends)
+        if self.use_future_cost and self.search == 'best-first':
+            self.future_cost = self.obtain_future_cost(src_word_array)
         else:
-            return False
+            self.future_cost = [0] * (len(src_word_array) + 1)
+
+        if self.search in ('viterbi', 'beam'):
+            hyp = self.stack_search(src_word_array, verbose)
+            return [hyp] if hyp.last_cov_pos >= 0 else []
 
-    def obtain_nblist(self, src_word_array, nblsize, verbose):
         # Insert initial hypothesis in stack
         priority_queue = PriorityQueue()
-        hyp = Hypothesis()
+        hyp = self.initial_hypothesis()
         priority_queue.put(hyp)
 
         # Create state dictionary
         stdict = StateInfoDict()
-        stdict.insert(obtain_state_info(self.tmodel, self.lmodel, hyp), hyp.score)
-        stdict.insert(obtain_state_info(self.tmodel, self.lmodel, hyp), hyp.score)
+        stdict.insert(self.hyp_state(hyp), hyp.score)
 
         # Obtain n-best hypotheses
         nblist = []
@@ -735,7 +1046,7 @@ class Decoder:
             hyp = self.best_first_search(src_word_array, priority_queue, stdict, verbose)
 
             # Append hypothesis to nblist
-            if len(hyp.data.coverage) > 0:
+            if hyp.last_cov_pos >= 0:
                 nblist.append(hyp)
 
         # return result
@@ -747,7 +1058,7 @@ class Decoder:
         if len(tok_array) > 0:
             # Init variables
             result = ""
-            coverage = best_hyp.data.coverage
+            coverage = self.hyp_coverage(best_hyp)
             # Iterate over hypothesis coverage array
             for i in range(len(coverage)):
                 # Obtain leftmost source position
@@ -778,10 +1089,12 @@ class Decoder:
                 return True, Hypothesis()
             else:
                 hyp = priority_queue.get()
-                sti = obtain_state_info(self.tmodel, self.lmodel, hyp)
-                if not stdict.hyp_recombined(sti, hyp.score):
+                if not stdict.hyp_recombined(self.hyp_state(hyp), hyp.score):
                     return False, hyp
 
+    def hyp_state(self, hyp):
+        return hyp.last_cov_pos, hyp.lm_state
+
     def best_first_search(self, src_word_array, priority_queue, stdict, verbose):
         # Initialize variables
         end = False
@@ -800,24 +1113,21 @@ class Decoder:
             else:
                 # Expand hypothesis
                 if verbose:
-                    print("** niter:", niter, " ; lp:", hyp.score, ";", str(hyp.data), file=sys.stderr)
+                    print("** niter:", niter, " ; lp:", hyp.score, ";", self.hyp_to_str(hyp).encode("utf-8"),
+                          file=sys.stderr)
                 # Stop if the hypothesis is complete
                 if self.hyp_is_complete(hyp, src_word_array):
                     end = True
                 else:
                     # Expand hypothesis
-                    for l in range(0, config.a_par):
-                        new_hyp_cov = self.last_cov_pos(hyp.data.coverage) + 1 + l
-                        if new_hyp_cov < len(src_word_array):
-                            # Obtain expansion
-                            exp_list = self.expand(src_word_array, hyp, new_hyp_cov, verbose)
-                            # Insert new hypotheses
-                            for k in range(len(exp_list)):
-                                # Insert hypothesis
-                                priority_queue.put(exp_list[k])
-                                # Update state info dictionary
-                                sti = obtain_state_info(self.tmodel, self.lmodel, exp_list[k])
-                                stdict.insert(sti, exp_list[k].score)
+                    self.counters['expansions'] += 1
+                    for new_hyp_cov in self.span_ends[hyp.last_cov_pos + 1]:
+                        # Obtain expansion, recombining it with the
+                        # hypotheses already found
+                        exp_list = self.expand(src_word_array, hyp, new_hyp_cov, verbose, stdict)
+                        # Insert new hypotheses
+                        for newhyp in exp_list:
+                            priority_queue.put(newhyp)
 
             niter += 1
 
@@ -846,6 +1156,74 @@ class Decoder:
                     )
                 return Hypothesis()
 
+    def stack_search(self, src_word_array, verbose):
+        """
+        Monotone dynamic programming (Viterbi) search.  stacks[j] keeps the
+        best hypothesis covering the source positions 0..j for each LM
+        state, since their expansions only depend on those two things.
+        The stacks are expanded left to right, so every hypothesis is
+        expanded once and the work is bounded by
+        O(len(src_word_array) * a_par * options).
+
+        With beam search only the best beam_width hypotheses of each stack
+        whose score is within beam_threshold of the best one are expanded,
+        which bounds the work per stack regardless of the ambiguity of the
+        models.  The bound applies to the expansions, not to the memory:
+        each stack still stores the best hypothesis of every LM state that
+        reaches it.
+        """
+        if verbose:
+            print("*** Starting stack search...", file=sys.stderr)
+
+        stacks = [{} for _ in src_word_array]
+        self.expand_into_stacks(src_word_array, self.initial_hypothesis(), stacks, verbose)
+        expansions = 1
+        for stack in stacks[:-1]:
+            for hyp in self.prune_stack(stack):
+                if verbose:
+                    print("** lp:", hyp.score, ";", self.hyp_to_str(hyp).encode("utf-8"), file=sys.stderr)
+                self.expand_into_stacks(src_word_array, hyp, stacks, verbose)
+                expansions += 1
+
+        final_hyps = stacks[-1].values() if stacks else ()
+        if not final_hyps:
+            if verbose:
+                print("Warning: stack search was unable to reach a complete hypothesis", file=sys.stderr)
+            return Hypothesis()
+
+        best_hyp = max(final_hyps, key=lambda hyp: hyp.score)
+        if verbose:
+            print(
+                "*** Stack search finished successfully after", expansions, "expansions, hyp. score:",
+                best_hyp.score, file=sys.stderr
+            )
+        return best_hyp
+
+    def prune_stack(self, stack):
+        """
+        returns the hypotheses of the stack to be expanded
+        """
+        if self.search != 'beam' or not stack:
+            return list(stack.values())
+
+        hyps = sorted(stack.values(), key=lambda hyp: hyp.score, reverse=True)
+        if self.beam_threshold is not None:
+            min_score = hyps[0].score - self.beam_threshold
+            hyps = [hyp for hyp in hyps if hyp.score >= min_score]
+        return hyps[:self.beam_width]
+
+    def expand_into_stacks(self, src_word_array, hyp, stacks, verbose):
+        self.counters['expansions'] += 1
+        if hyp.last_cov_pos + 1 >= len(src_word_array):
+            return
+        for new_hyp_cov in self.span_ends[hyp.last_cov_pos + 1]:
+            stack = stacks[new_hyp_cov]
+            for newhyp in self.expand(src_word_array, hyp, new_hyp_cov, verbose):
+                # Keep the best hypothesis of each state
+                best_hyp = stack.get(newhyp.lm_state)
+                if best_hyp is None or newhyp.score > best_hyp.score:
+                    stack[newhyp.lm_state] = newhyp
+
     def detokenize(self, line, verbose=False):
         # Obtain array with tokenized words
         tok_array = split_string_to_words(line)
@@ -888,7 +1266,7 @@ class Decoder:
                 return line
             else:
                 best_hyp = nblist[0]
-                return best_hyp.data.words
+                return u" ".join(self.hyp_words(best_hyp))
         return ""
 
 default_atoms = [
@@ -1095,6 +1473,8 @@ default_atoms = [
     "E.G."
 ]
 
+TOKENIZER_ENGINES = ('regex', 'trie')
+
 _default_word_chars = \
     u"-.&" \
     u"0123456789" \
@@ -1110,62 +1490,208 @@ _default_word_chars = \
     u"άέήίΰαβγδεζηθικλμνξοπρςστυφχψω"
 
 
+def load_atoms(filename):
+    """
+    Reads a file with one atom per line (utf-8), empty lines are ignored
+    """
+    with io.open(filename, 'r', encoding='utf-8') as fd:
+        return [atom for atom in (line.strip() for line in fd) if atom]
+
+
+_match_span = operator.methodcaller('span')
+_non_space = re.compile('\\S')
+
+
+# Groups of characters matched with each other by re.IGNORECASE although
+# their lowercase forms differ (e.g. s and long s, or the two forms of the
+# small sigma), the first one of each group represents the rest
+_CASE_EQUIVALENCES = (
+    (0x69, 0x131), (0x73, 0x17f), (0xb5, 0x3bc), (0x3b9, 0x345, 0x1fbe), (0x390, 0x1fd3), (0x3b0, 0x1fe3),
+    (0x3b2, 0x3d0), (0x3b5, 0x3f5), (0x3b8, 0x3d1), (0x3ba, 0x3f0), (0x3c0, 0x3d6), (0x3c1, 0x3f1),
+    (0x3c3, 0x3c2), (0x3c6, 0x3d5), (0x432, 0x1c80), (0x434, 0x1c81), (0x43e, 0x1c82), (0x441, 0x1c83),
+    (0x442, 0x1c84, 0x1c85), (0x44a, 0x1c86), (0x463, 0x1c87), (0xa64b, 0x1c88), (0x1e61, 0x1e9b),
+    (0xfb05, 0xfb06),
+)
+_case_fold_table = dict(
+    (code, _unichr(equivalence[0])) for equivalence in _CASE_EQUIVALENCES for code in equivalence[1:]
+)
+
+
+def _fold_case(text):
+    # Lowercases text as re.IGNORECASE compares characters, keeping one
+    # character per original character, so that offsets in the folded text
+    # are also valid in the original one
+    folded = text.lower()
+    if len(folded) != len(text):
+        folded = u''.join(c.lower()[:1] for c in text)
+    return folded.translate(_case_fold_table)
+
+
 class Tokenizer:
-    def __init__(self, atoms=default_atoms, word_chars=_default_word_chars):
+    def __init__(self, atoms=default_atoms, word_chars=_default_word_chars, engine='regex'):
         """Initializer.
         Atom is a string that won't be split into separate tokens.  Longer
         atoms take precedence over their prefixes, e.g.: if 'a' and 'ab' are
         passed as atoms 'ab' will be returned.
+
+        With the 'regex' engine atoms are alternatives of the tokenization
+        regex, with the 'trie' engine they are looked up in a prefix tree
+        before trying the regex, so the matching cost does not grow with the
+        number of atoms.  Both engines return the same tokens, the trie
+        compares atoms ignoring case the same way as re.IGNORECASE.
         """
+        if engine not in TOKENIZER_ENGINES:
+            raise ValueError("Unknown tokenizer engine: %s" % engine)
 
-        atoms = list(map(re.escape, sorted(atoms, key=len, reverse=True)))
         word_chars = re.escape(word_chars)
+        patterns = [
+            "\\b[0-9]+,[0-9]+[a-zA-Z]+\\b",
+            "\\b[0-9]+,[0-9]+\\b",
+            "[%s]+(?:'[sS])?" % word_chars,
+            "\\s+"
+        ]
+
+        if engine == 'trie':
+            self.atom_trie = Trie(_fold_case(atom) for atom in atoms if atom)
+        else:
+            self.atom_trie = None
+            patterns = list(map(re.escape, sorted(atoms, key=len, reverse=True))) + patterns
 
-        self.re = re.compile("(?:" + "|".join(
-            atoms + [
-                "\\b[0-9]+,[0-9]+[a-zA-Z]+\\b",
-                "\\b[0-9]+,[0-9]+\\b",
-                "[%s]+(?:'[sS])?" % word_chars,
-                "\s+"
-            ]) + ")", flags=re.I)
+        self.re = re.compile("(?:" + "|".join(patterns) + ")", flags=re.I)
 
-    def tokenize(self, text):
-        """Tokenize text :: string -> [strings].
-        Concatenation of returned tokens should yields.
+    def _iter_spans(self, text, pos, endpos):
+        """
+        Returns an iterator over the (start, end) offsets of the regex (and
+        atom) matches in text[pos:endpos]
+        """
+        if self.atom_trie is None:
+            return map(_match_span, self.re.finditer(text, pos, endpos))
+        else:
+            return self._iter_trie_spans(text, pos, endpos)
+
+    def _iter_trie_spans(self, text, pos, endpos):
+        # Offsets in the folded text are relative to base
+        base = pos
+        folded = _fold_case(text[pos:endpos])
+        longest_atom = self.atom_trie.longest_match
+        match = self.re.match
+        while pos < endpos:
+            end = longest_atom(folded, pos - base)
+            if end < 0:
+                m = match(text, pos, endpos)
+                if m is None:
+                    pos += 1
+                    continue
+                end = m.end()
+            else:
+                end += base
+            yield pos, end
+            pos = end
+
+    def tokenize_spans(self, text, pos=0, endpos=None):
+        """Tokenize text[pos:endpos] :: string -> [(start, end)].
+        Returns the offsets of the tokens in text instead of the tokens.
         """
+        if endpos is None:
+            endpos = len(text)
 
         # Following is a safeguard that guarantees that concatenating resultant
         # tokens yield original text.  It fills gaps between matches returned
-        # by findall().  Ideally, it shouldn't be needed.  findall() should
+        # by finditer().  Ideally, it shouldn't be needed.  finditer() should
         # return all required substrings.
         #
         # However, REs are tricky, mistakes happen, therefore we choose to be
-        # defensive:
-        matches = self.re.findall(text)
-        tokens = []
-        p = 0
-        for match in matches:
-            mp = text[p:].find(match)
-            if mp != 0:
-                missed = text[p:p + mp]
-                tokens.append(missed)
-            p = p + mp + len(match)
-            tokens.append(match)
-
-        if p < len(text):
-            tokens.append(text[p:])
-        return filter(lambda s: s.strip(), tokens)
-
-
-def tokenize(string):
-    tokenizer = Tokenizer()
-    skel = list(annotated_string_to_xml_skeleton(string))
-    for idx, (is_tag, txt) in enumerate(skel):
+        # defensive.  Gaps are recovered from the match offsets, so the whole
+        # text is processed in a single linear pass.
+        non_space = _non_space.search
+        spans = []
+        p = pos
+        for start, end in self._iter_spans(text, pos, endpos):
+            if p < start and non_space(text, p, start):
+                spans.append((p, start))
+            # Whitespace runs are matched but are not tokens
+            if not text[start].isspace() or non_space(text, start, end):
+                spans.append((start, end))
+            p = end
+
+        if p < endpos and non_space(text, p, endpos):
+            spans.append((p, endpos))
+        return spans
+
+    def tokenize(self, text):
+        """Tokenize text :: string -> [strings].
+        Concatenation of returned tokens should yields.
+        """
+        return [text[start:end] for start, end in self.tokenize_spans(text)]
+
+
+_tokenizers = {}
+
+
+def get_tokenizer(atoms=None, word_chars=None, engine='regex'):
+    """
+    Returns the compiled Tokenizer registered for the given atoms, word
+    characters and engine, building it only the first time it is requested.
+    None selects the default atoms / word characters.
+    """
+    key = (None if atoms is None else frozenset(atoms), word_chars, engine)
+    tokenizer = _tokenizers.get(key)
+    if tokenizer is None:
+        tokenizer = Tokenizer(
+            atoms=default_atoms if atoms is None else atoms,
+            word_chars=_default_word_chars if word_chars is None else word_chars,
+            engine=engine,
+        )
+        _tokenizers[key] = tokenizer
+    return tokenizer
+
+
+def tokenize_xml_skeleton(skeleton, tokenizer):
+    """
+    Tokenizes the text of a skeleton of (is_tag, tokens) pairs
+    returns a new skeleton
+    """
+    tok_skeleton = []
+    for is_tag, tokens in skeleton:
+        if is_tag:
+            tok_skeleton.append((is_tag, tokens))
+        else:
+            tok_skeleton.append((is_tag, tokenizer.tokenize(u' '.join(tokens))))
+    return tok_skeleton
+
+
+def tokenize(string, tokenizer=None):
+    if tokenizer is None:
+        tokenizer = get_tokenizer()
+    skeleton = annotated_string_to_token_skeleton(string)
+    return xml_skeleton_to_tokens(tokenize_xml_skeleton(skeleton, tokenizer))
+
+
+def tokenize_many(lines, tokenizer=None):
+    """
+    Tokenizes an iterable of lines with a single compiled tokenizer
+    yields the list of tokens of each line
+    """
+    if tokenizer is None:
+        tokenizer = get_tokenizer()
+    for line in lines:
+        yield tokenize(line, tokenizer)
+
+
+def tokenize_spans(string, tokenizer=None):
+    """
+    Tokenizes an annotated string
+    returns the (start, end) offsets of its tokens (including XML tags)
+    """
+    if tokenizer is None:
+        tokenizer = get_tokenizer()
+    spans = []
+    for is_tag, start, end in annotated_string_to_xml_spans(string):
         if is_tag:
-            skel[idx][1] = [skel[idx][1]]
+            spans.append((start, end))
         else:
-            skel[idx][1] = tokenizer.tokenize(txt)
-    return xml_skeleton_to_tokens(skel)
+            spans.extend(tokenizer.tokenize_spans(string, start, end))
+    return spans
 
 
 def xml_skeleton_to_tokens(skeleton):
@@ -1178,15 +1704,27 @@ def xml_skeleton_to_tokens(skeleton):
     return annotated
 
 
-def lowercase(string):
-    # return str.lower()
-    skel = []
-    for is_tag, txt in annotated_string_to_xml_skeleton(string):
-        skel.append(
-            (is_tag, txt.strip() if is_tag else txt.lower().strip())
-        )
+def lowercase_xml_skeleton(skeleton):
+    """
+    Lowercases the text of a skeleton of (is_tag, tokens) pairs
+    returns a new skeleton
+    """
+    lc_skeleton = []
+    for is_tag, tokens in skeleton:
+        if is_tag:
+            lc_skeleton.append((is_tag, tokens))
+        else:
+            lc_tokens = [token.lower() for token in tokens]
+            # Untokenized text is kept as a single token
+            if len(lc_tokens) == 1:
+                lc_tokens[0] = lc_tokens[0].strip()
+            lc_skeleton.append((is_tag, lc_tokens))
+    return lc_skeleton
 
-    return xml_skeleton_to_string(skel)
+
+def lowercase(string):
+    skeleton = annotated_string_to_token_skeleton(string)
+    return u' '.join(xml_skeleton_to_tokens(lowercase_xml_skeleton(skeleton)))
 
 
 def xml_skeleton_to_string(skeleton):
@@ -1196,41 +1734,66 @@ def xml_skeleton_to_string(skeleton):
     return u" ".join(txt for _, txt in skeleton)
 
 
-def annotated_string_to_xml_skeleton(annotated):
+# (first group, is_tag flag of each group) of the two alternatives of
+# config._annotation
+_dic_ann_groups = (1, (True, True, False, True, True, False, True, True))
+_len_ann_groups = (9, (True, False, True))
+
+
+def annotated_string_to_xml_spans(annotated):
     """
     Parses a string looking for XML annotations
-    returns a vector where each element is a pair (is_tag, text)
+    returns a vector where each element is a tuple (is_tag, start, end) with
+    the offsets of the element in the string
     """
+    # Fast path: every annotation contains a '<'
+    if '<' not in annotated:
+        return [(False, 0, len(annotated))] if annotated else []
+
+    spans = []
     offset = 0
     for m in config._annotation.finditer(annotated):
         if offset < m.start():
-            yield [False, annotated[offset:m.start()]]
+            spans.append((False, offset, m.start()))
         offset = m.end()
-        g = m.groups()
-        dic_g = [x for x in g[0:8] if x]
-        len_g = [x for x in g[8:11] if x]
-        if dic_g:
-            yield [True, dic_g[0]]
-            yield [True, dic_g[1]]
-            yield [False, dic_g[2]]
-            yield [True, dic_g[3]]
-            yield [True, dic_g[4]]
-            yield [False, dic_g[5]]
-            yield [True, dic_g[6]]
-            yield [True, dic_g[7]]
-        elif len_g:
-            yield [True, len_g[0]]
-            yield [False, len_g[1]]
-            yield [True, len_g[2]]
+        if m.start(_dic_ann_groups[0]) >= 0:
+            first_group, tag_flags = _dic_ann_groups
+        elif m.start(_len_ann_groups[0]) >= 0:
+            first_group, tag_flags = _len_ann_groups
         else:
-            sys.stderr.write('WARNING:\n - s: %s\n - g: %s\n' % (annotated, g))
+            sys.stderr.write('WARNING:\n - s: %s\n - g: %s\n' % (annotated, m.groups()))
+            continue
+        for group, is_tag in enumerate(tag_flags, first_group):
+            spans.append((is_tag, m.start(group), m.end(group)))
     if offset < len(annotated):
-        yield [False, annotated[offset:]]
+        spans.append((False, offset, len(annotated)))
+    return spans
+
+
+def annotated_string_to_xml_skeleton(annotated):
+    """
+    Parses a string looking for XML annotations
+    returns a vector where each element is a pair (is_tag, text)
+    """
+    if '<' not in annotated:
+        return [(False, annotated)] if annotated else []
+    return [(is_tag, annotated[start:end]) for is_tag, start, end in annotated_string_to_xml_spans(annotated)]
+
+
+def annotated_string_to_token_skeleton(annotated):
+    """
+    Parses a string looking for XML annotations
+    returns a vector where each element is a pair (is_tag, tokens), the
+    text between tags is kept untokenized as a single token
+    """
+    if '<' not in annotated:
+        return [(False, [annotated])] if annotated else []
+    return [(is_tag, [text]) for is_tag, text in annotated_string_to_xml_skeleton(annotated)]
 
 
 def remove_xml_annotations(annotated):
     xml_tags = {'<' + config.src_ann + '>', '</' + config.len_ann + '>', '</' + config.grp_ann + '>'}
-    skeleton = list(annotated_string_to_xml_skeleton(annotated))
+    skeleton = annotated_string_to_xml_skeleton(annotated)
     tokens = []
     for i, (is_tag, text) in enumerate(skeleton):
         token = text.strip()
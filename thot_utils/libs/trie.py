@@ -0,0 +1,83 @@
+# -*- coding:utf-8 -*-
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Key marking the end of a stored sequence, it can't collide with the items
+# of the sequences (characters or words)
+_END = None
+
+
+class Trie(object):
+    """
+    Prefix tree over sequences of hashable items (characters, words...)
+    """
+
+    def __init__(self, sequences=()):
+        self.root = {}
+        self.size = 0
+        for sequence in sequences:
+            self.add(sequence)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, sequence):
+        node = self.root
+        for item in sequence:
+            node = node.get(item)
+            if node is None:
+                return False
+        return _END in node
+
+    def add(self, sequence):
+        node = self.root
+        for item in sequence:
+            child = node.get(item)
+            if child is None:
+                child = node[item] = {}
+            node = child
+        if _END not in node:
+            node[_END] = True
+            self.size += 1
+
+    def longest_match(self, sequence, start=0, end=None):
+        """
+        Returns the end index of the longest stored sequence found at
+        sequence[start:end], or -1 if none of them is found there.
+        The cost depends on the length of the match, not on the number of
+        stored sequences.
+        """
+        if end is None:
+            end = len(sequence)
+        node = self.root
+        match_end = -1
+        i = start
+        while i < end:
+            node = node.get(sequence[i])
+            if node is None:
+                break
+            i += 1
+            if _END in node:
+                match_end = i
+        return match_end
+
+    def match_ends(self, sequence, start=0, end=None):
+        """
+        Returns the end indexes, in increasing order, of all the stored
+        sequences found at sequence[start:end].  The walk stops as soon as
+        sequence[start:i] is not a prefix of any stored sequence.
+        """
+        if end is None:
+            end = len(sequence)
+        node = self.root
+        match_ends = []
+        i = start
+        while i < end:
+            node = node.get(sequence[i])
+            if node is None:
+                break
+            i += 1
+            if _END in node:
+                match_ends.append(i)
+        return match_ends
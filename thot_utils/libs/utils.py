@@ -3,7 +3,10 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import argparse
 import re
+import sys
+from collections import OrderedDict
 
 from thot_utils.libs import config
 
@@ -14,7 +17,18 @@ def split_string_to_words(s):
     return [n for n in split_regex.split(s) if n]
 
 
-def transform_word(word):
+# Only strings starting like this can be parsed by float(), the rest of
+# them are rejected without raising and catching an exception
+_float_prefix = re.compile(r'\s*[+-]?(?:\.?\d|inf|nan)', flags=re.I | re.U)
+# Words starting with an ASCII alphanumeric character and containing a digit
+_alfanum = re.compile(r'(?=[a-zA-Z0-9]).*?\d', flags=re.S | re.U)
+
+_WORD_CLASSES_MAXSIZE = 100000
+_word_classes = {}
+_NOT_CLASSIFIED = object()
+
+
+def _classify_word(word):
     if word.isdigit():
         if len(word) > 1:
             return config.number_str
@@ -22,8 +36,30 @@ def transform_word(word):
             return config.digit_str
     elif is_number(word):
         return config.number_str
-    elif is_alnum(word) and bool(config.digits.search(word)):
+    elif _alfanum.match(word):
         return config.alfanum_str
+    else:
+        return None
+
+
+def classify_word(word):
+    """
+    Returns the category of word (digit, number or alfanum) or None if it
+    doesn't belong to any of them.  The results are memoized in a table
+    that is emptied when it grows beyond _WORD_CLASSES_MAXSIZE entries.
+    """
+    categ = _word_classes.get(word, _NOT_CLASSIFIED)
+    if categ is _NOT_CLASSIFIED:
+        if len(_word_classes) >= _WORD_CLASSES_MAXSIZE:
+            _word_classes.clear()
+        categ = _word_classes[word] = _classify_word(word)
+    return categ
+
+
+def transform_word(word):
+    categ = classify_word(word)
+    if categ is not None:
+        return categ
     elif len(word) > 5:
         return config.common_word_str
     else:
@@ -31,6 +67,8 @@ def transform_word(word):
 
 
 def is_number(s):
+    if not _float_prefix.match(s):
+        return False
     try:
         float(s)
         return True
@@ -51,3 +89,103 @@ def is_categ(word):
         return True
     else:
         return False
+
+
+def positive_int(value):
+    """
+    argparse type of the options that only accept positive integers
+    """
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError("%s is not a positive integer" % value)
+    return number
+
+
+def non_negative_float(value):
+    """
+    argparse type of the options that only accept non-negative numbers
+    """
+    number = float(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError("%s is not a non-negative number" % value)
+    return number
+
+
+class LRUCache(object):
+    """
+    Bounded mapping that evicts its least recently used entry when full and
+    counts lookup hits and misses
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        # Reinsert the entry as the most recently used one
+        self.data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key in self.data:
+            del self.data[key]
+        elif len(self.data) >= self.maxsize:
+            self.data.popitem(last=False)
+        self.data[key] = value
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def stats(self):
+        return "%d hits, %d misses (%.2f%% hit rate), %d/%d entries" % (
+            self.hits, self.misses, 100 * self.hit_rate(), len(self.data), self.maxsize
+        )
+
+
+class MemoryBudget(object):
+    """
+    Approximate number of bytes used by the model tables preloaded in
+    memory, limited to max_bytes (None for no limit)
+    """
+    # Estimation of the bytes taken by each entry of a dictionary besides
+    # its key and value
+    DICT_ENTRY_BYTES = 64
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def charge(self, key, value):
+        """
+        Adds the size of a dictionary entry
+        returns False if the limit is exceeded
+        """
+        self.size += sys.getsizeof(key) + sys.getsizeof(value) + self.DICT_ENTRY_BYTES
+        return self.max_bytes is None or self.size <= self.max_bytes
+
+
+def preload_table(connection, query, budget):
+    """
+    returns a dictionary mapping the first column of the rows of query to
+    the second one, or None if it does not fit in budget
+    """
+    table = {}
+    for key, value in connection.execute(query):
+        table[key] = value
+        if not budget.charge(key, value):
+            return None
+    return table